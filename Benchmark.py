@@ -0,0 +1,355 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tracemalloc
+import numpy as np
+from time import perf_counter, sleep
+from Flock import Flock
+from FlockCore import NUMBA_AVAILABLE
+from DomainDecomposition import DecomposedFlock
+
+
+SIZES = (100, 1_000, 10_000, 100_000)
+# all pairs backends are skipped above these sizes, one frame would take minutes
+BACKEND_LIMITS = {'python': 1_000, 'numpy': 10_000, 'numba': 10_000}
+# the compute core is imported by headless runs and worker processes, it must not load any of these
+LAZY_MODULES = ('pygame', 'pymunk', 'scipy.spatial', 'thorpy', 'UserInterface')
+# hardware events counted by perf stat during the steady frames of the locality benchmark, cache level names
+# differ between processors, l2_rqsts.miss on intel for example, so they can be chosen with --perf-events
+PERF_EVENTS = ('cache-references', 'cache-misses', 'L1-dcache-load-misses')
+# flock of the float32 drift check, small enough to run with every benchmark
+DRIFT_BOIDS = 2_000
+RULES = dict(check_boundaries=True,
+             horizontal_cyclic_boundary=False,
+             vertical_cyclic_boundary=True,
+             separation_active=True,
+             alignment_active=True,
+             cohesion_active=True,
+             vertical_wall_active=True,
+             horizontal_wall_active=True)
+
+
+def create_flock(number_of_boids: int, backend: str, seed: int, **flock_options):
+    np.random.seed(seed)
+    return Flock(number_of_boids, None,
+                 space_coordinates=(1920, 1080),
+                 boid_size=2,
+                 speed_scale=200,
+                 speed_range=(1, 2),
+                 speed_active=True,
+                 avoid_range=15,
+                 avoid_factor=2,
+                 align_range=100,
+                 align_factor=0.08,
+                 cohesion_range=50,
+                 cohesion_factor=0.005,
+                 turn_margin=80,
+                 turn_factor=20,
+                 backend=backend,
+                 **flock_options)
+
+
+def step_flock(flock: Flock | DecomposedFlock, dt: float):
+    flock.step(dt, **RULES)
+
+
+def start_counters(events: tuple[str, ...]):
+    # perf stat attached to this process, None where perf is not installed or there are no events to count
+    if not events or shutil.which('perf') is None:
+        return None
+    process = subprocess.Popen(['perf', 'stat', '-x', ',', '-e', ','.join(events), '-p', str(os.getpid())],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    # perf needs a moment to attach before the counted frames start
+    sleep(0.2)
+    return process
+
+
+def stop_counters(process: subprocess.Popen | None):
+    if process is None:
+        return None
+    process.send_signal(signal.SIGINT)
+    _, output = process.communicate()
+    counters = {}
+    for line in output.splitlines():
+        fields = line.split(',')
+        # unsupported events are reported as <not supported> or <not counted>
+        if len(fields) > 2 and fields[0].isdigit():
+            counters[fields[2]] = int(fields[0])
+    return counters
+
+
+def benchmark_flock(flock: Flock | DecomposedFlock, frames: int, max_time: float, dt: float = 1 / 30,
+                    events: tuple[str, ...] = ()):
+    # the first frame includes numba compilation, it is reported apart from the steady state
+    start = perf_counter()
+    step_flock(flock, dt)
+    first_frame = perf_counter() - start
+
+    frame_times = []
+    total_time = 0
+    counters = start_counters(events)
+    while len(frame_times) < frames and total_time < max_time:
+        start = perf_counter()
+        step_flock(flock, dt)
+        frame_times.append(perf_counter() - start)
+        total_time += frame_times[-1]
+    counters = stop_counters(counters)
+
+    # allocations are traced in a separate frame, tracemalloc slows down python code,
+    # arrays allocated inside numba kernels are not seen by tracemalloc
+    tracemalloc.start()
+    step_flock(flock, dt)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    frame_times = np.array(frame_times)
+    return {
+        'frames': len(frame_times),
+        'first_frame': first_frame,
+        'warmup': max(first_frame - float(np.median(frame_times)), 0),
+        'median': float(np.median(frame_times)),
+        'p95': float(np.percentile(frame_times, 95)),
+        'mean': float(frame_times.mean()),
+        'peak_frame_memory': peak_memory,
+        'counters': counters,
+    }
+
+
+def benchmark_backend(backend: str, number_of_boids: int, frames: int, max_time: float, seed: int,
+                      dtype: type = np.float64):
+    result = {'backend': backend, 'boids': number_of_boids, 'dtype': np.dtype(dtype).name}
+    if number_of_boids > BACKEND_LIMITS.get(backend, number_of_boids):
+        result['skipped'] = f'more than {BACKEND_LIMITS[backend]} boids'
+        return result
+    flock = create_flock(number_of_boids, backend, seed, dtype=dtype)
+    result['compile'] = flock.warm_up(RULES)
+    result.update(benchmark_flock(flock, frames, max_time))
+    result['state_memory'] = flock.state.get_memory()
+    if backend == 'verlet':
+        result['neighbor_list'] = flock.get_neighbor_list_stats()
+    return result
+
+
+def benchmark_decomposition(number_of_boids: int, workers: int, frames: int, max_time: float, seed: int):
+    result = {'backend': 'grid', 'boids': number_of_boids, 'workers': workers}
+    # the first frame also waits for the worker processes to start and compile
+    decomposed_flock = DecomposedFlock(create_flock(number_of_boids, 'grid', seed), workers)
+    try:
+        result.update(benchmark_flock(decomposed_flock, frames, max_time))
+    finally:
+        decomposed_flock.close()
+    return result
+
+
+def benchmark_locality(number_of_boids: int, reorder_interval: int, frames: int, max_time: float, seed: int,
+                       events: tuple[str, ...]):
+    result = {'backend': 'grid', 'boids': number_of_boids, 'reorder_interval': reorder_interval}
+    # boids are created at random positions, so rows of neighbors are scattered in memory from the first frame,
+    # as they are in a flock that has not been reordered for a few hundred frames
+    flock = create_flock(number_of_boids, 'grid', seed, reorder_interval=reorder_interval)
+    result['compile'] = flock.warm_up(RULES)
+    result.update(benchmark_flock(flock, frames, max_time, events=events))
+    return result
+
+
+def measure_drift(number_of_boids: int, backend: str, steps: int, seed: int, dt: float = 1 / 30):
+    # every step of the float32 flock starts from the float64 state, so the error of one step is measured
+    # apart from the divergence of the two trajectories, which grows as soon as a boid gains or loses a
+    # neighbor in one of them, boids right at the edge of a rule range do that even within one step, so the
+    # step error is bounded by a percentile and not by its maximum
+    reference = create_flock(number_of_boids, backend, seed, reorder_interval=0)
+    flock = create_flock(number_of_boids, backend, seed, reorder_interval=0, dtype=np.float32)
+    step_errors = []
+    for _ in range(steps):
+        for name in ('position', 'velocity', 'angle', 'speed'):
+            getattr(flock.state, name)[:] = getattr(reference.state, name)
+        step_flock(reference, dt)
+        step_flock(flock, dt)
+        step_errors.append(np.abs(flock.state.position - reference.state.position).max(axis=1))
+    step_errors = np.concatenate(step_errors)
+    # the same two flocks stepped on their own from the same start
+    reference = create_flock(number_of_boids, backend, seed, reorder_interval=0)
+    flock = create_flock(number_of_boids, backend, seed, reorder_interval=0, dtype=np.float32)
+    for _ in range(steps):
+        step_flock(reference, dt)
+        step_flock(flock, dt)
+    trajectory_errors = np.abs(flock.state.position - reference.state.position).max(axis=1)
+    return {
+        'backend': backend,
+        'boids': number_of_boids,
+        'steps': steps,
+        'step_p99': float(np.percentile(step_errors, 99)),
+        'step_max': float(step_errors.max()),
+        'trajectory_median': float(np.median(trajectory_errors)),
+        'trajectory_max': float(trajectory_errors.max()),
+    }
+
+
+def measure_import_time(module: str = 'Flock'):
+    # a fresh interpreter with -X importtime, so nothing is imported or cached in memory yet
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    import_times = {}
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                import_times[name.strip()] = int(cumulative) / 1e6
+    return {
+        'module': module,
+        'time': import_times.get(module),
+        'lazy_modules_loaded': [name for name in LAZY_MODULES if name in import_times],
+    }
+
+
+def get_metadata(seed: int):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    metadata = {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': np.__version__,
+        'seed': seed,
+        'rules': RULES,
+    }
+    if NUMBA_AVAILABLE:
+        import numba
+        metadata['numba'] = numba.__version__
+        metadata['numba_threads'] = numba.config.NUMBA_NUM_THREADS
+    return metadata
+
+
+def get_result_key(result: dict):
+    return (result['backend'], result['boids'], result.get('workers'), result.get('reorder_interval'),
+            result.get('dtype', 'float64'))
+
+
+def compare_results(baseline: dict, results: dict, tolerance: float):
+    baseline_results = {get_result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        old_result = baseline_results.get(get_result_key(result))
+        if old_result is None or 'median' not in old_result or 'median' not in result:
+            continue
+        change = result['median'] / old_result['median'] - 1
+        print(f"{result['backend']:>8} {result['boids']:>8} {result.get('dtype', 'float64')}: "
+              f"median {old_result['median']:.6f} s -> "
+              f"{result['median']:.6f} s ({change:+.1%})")
+        if change > tolerance:
+            regressions.append(result)
+    return regressions
+
+
+def parse_arguments(arguments: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Benchmark flock velocity update backends.')
+    parser.add_argument('-b', '--backends', nargs='+', choices=Flock.get_available_backends(),
+                        default=Flock.get_available_backends())
+    parser.add_argument('-n', '--sizes', nargs='+', type=int, default=SIZES, help='flock sizes')
+    parser.add_argument('-f', '--frames', type=int, default=20, help='steady state frames per case')
+    parser.add_argument('--max-time', type=float, default=10, help='time budget of steady frames per case')
+    parser.add_argument('-w', '--workers', nargs='+', type=int, default=None,
+                        help='run the domain decomposition scaling benchmark with these worker counts instead, '
+                             'one worker is always added as the baseline of the speedup')
+    parser.add_argument('-r', '--reorder', nargs='+', type=int, default=None,
+                        help='run the memory locality benchmark of the grid backend with these reorder intervals '
+                             'instead, 0 never reorders')
+    parser.add_argument('--perf-events', nargs='+', default=PERF_EVENTS,
+                        help='hardware events counted with perf stat in the locality benchmark')
+    parser.add_argument('-p', '--precision', nargs='+', choices=('float64', 'float32'), default=['float64'],
+                        help='dtypes of the flock state the backends are timed with')
+    parser.add_argument('--drift-steps', type=int, default=30,
+                        help=f'steps of the float32 drift check on {DRIFT_BOIDS} boids, 0 skips it')
+    parser.add_argument('--drift-tolerance', type=float, default=1e-3,
+                        help='allowed 99th percentile of the position error of one float32 step in pixels')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help='json file for the results')
+    parser.add_argument('--compare', default=None, help='json results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative median slowdown')
+    parser.add_argument('--import-budget', type=float, default=0.5,
+                        help='allowed import time of the Flock module in seconds')
+    return parser.parse_args(arguments)
+
+
+def main(arguments: list[str] | None = None):
+    arguments = parse_arguments(arguments)
+    results = {'metadata': get_metadata(arguments.seed), 'import': measure_import_time(), 'results': []}
+    import_result = results['import']
+    print(f"import {import_result['module']}: {import_result['time']:.3f} s, "
+          f"budget {arguments.import_budget:.3f} s, lazy modules loaded {import_result['lazy_modules_loaded']}")
+    over_budget = import_result['time'] > arguments.import_budget or import_result['lazy_modules_loaded']
+    drift_exceeded = False
+    if arguments.drift_steps > 0:
+        drift = measure_drift(DRIFT_BOIDS, 'grid' if NUMBA_AVAILABLE else 'numpy', arguments.drift_steps,
+                              arguments.seed)
+        results['drift'] = drift
+        print(f"float32 drift of {drift['boids']} boids: step p99 {drift['step_p99']:.2e} px, "
+              f"step max {drift['step_max']:.2e} px, tolerance {arguments.drift_tolerance:.2e} px, "
+              f"after {drift['steps']} steps median {drift['trajectory_median']:.2e} px")
+        drift_exceeded = drift['step_p99'] > arguments.drift_tolerance
+    for number_of_boids in arguments.sizes:
+        # the speedup is measured against one worker, which is always run first
+        single_worker = None
+        for workers in sorted({1, *arguments.workers}) if arguments.workers else []:
+            result = benchmark_decomposition(number_of_boids, workers, arguments.frames, arguments.max_time,
+                                             arguments.seed)
+            results['results'].append(result)
+            single_worker = single_worker or result
+            print(f"{workers:>3} workers {number_of_boids:>8}: first {result['first_frame']:.4f} s, "
+                  f"median {result['median']:.6f} s, p95 {result['p95']:.6f} s, "
+                  f"speedup over 1 worker {single_worker['median'] / result['median']:.2f}")
+        for reorder_interval in arguments.reorder or []:
+            result = benchmark_locality(number_of_boids, reorder_interval, arguments.frames, arguments.max_time,
+                                        arguments.seed, tuple(arguments.perf_events))
+            results['results'].append(result)
+            counters = ', '.join(f'{event} {count}' for event, count in (result['counters'] or {}).items())
+            print(f"reorder every {reorder_interval:>4} {number_of_boids:>8}: median {result['median']:.6f} s, "
+                  f"p95 {result['p95']:.6f} s{', ' + counters if counters else ''}")
+        if arguments.workers or arguments.reorder:
+            continue
+        for backend, precision in itertools.product(arguments.backends, arguments.precision):
+            result = benchmark_backend(backend, number_of_boids, arguments.frames, arguments.max_time,
+                                       arguments.seed, np.dtype(precision))
+            results['results'].append(result)
+            if 'skipped' in result:
+                print(f"{backend:>8} {number_of_boids:>8}: skipped, {result['skipped']}")
+            else:
+                print(f"{backend:>8} {number_of_boids:>8}: first {result['first_frame']:.4f} s, "
+                      f"median {result['median']:.6f} s, p95 {result['p95']:.6f} s, "
+                      f"{number_of_boids / result['median']:.3g} boids/s, "
+                      f"peak memory {result['peak_frame_memory'] / 2 ** 20:.1f} MB, "
+                      f"{precision} state {result['state_memory'] / 2 ** 20:.1f} MB")
+                if 'neighbor_list' in result:
+                    neighbor_list = result['neighbor_list']
+                    print(f"{'':>17}  neighbor list rebuilt in {neighbor_list['rebuild_rate']:.0%} of frames, "
+                          f"{neighbor_list['memory'] / 2 ** 20:.1f} MB")
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if arguments.compare is not None:
+        with open(arguments.compare) as file:
+            baseline = json.load(file)
+        regressions = compare_results(baseline, results, arguments.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regressions above {arguments.tolerance:.0%}')
+            return 1
+    if over_budget:
+        print('import of the compute core is over budget')
+        return 1
+    if drift_exceeded:
+        print('float32 drift is above the tolerance')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
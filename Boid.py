@@ -0,0 +1,77 @@
+import pymunk
+import numpy as np
+from pymunk import Vec2d
+
+
+class Boid:
+    def __init__(self, position: tuple[int, int], angle: float,
+                 scale: float = 1, speed: int = 1):
+        self.body = None
+        self.shape = None
+        self.saved_speed = Vec2d(0, 0)
+        self.speed = speed
+        self.create(position, angle, scale)
+
+    def create(self, position: tuple[int, int], angle: float, scale: float):
+        triangle_vertices = [
+            (0, 1 * scale),
+            (0, -1 * scale),
+            (3 * scale, 0)
+        ]
+        self.body = pymunk.Body(body_type=pymunk.Body.KINEMATIC)
+        self.body.position = position
+        self.body.angle = angle
+        self.shape = pymunk.Poly(self.body, triangle_vertices)
+        self.shape.color = (0, np.random.randint(100, 200), 255, 255)
+
+    def change_boid(self, position: tuple[int, int], angle: float, speed_active: bool):
+        self.body.position = position
+        self.body.angle = angle
+        if speed_active:
+            self.accelerate()
+
+    def change_velocity(self, vx: float, vy: float, vmax: int, vmin: int):
+        self.body.angle = np.arctan2(-vx, vy) + np.pi / 2
+        velocity = Vec2d(vx, vy)
+        speed = abs(velocity)
+        if speed >= vmax:
+            self.body.velocity = velocity.normalized() * vmax
+            self.speed = vmax
+        elif speed < vmin:
+            self.body.velocity = velocity.normalized() * vmin
+            self.speed = vmin
+        else:
+            self.body.velocity = velocity
+            self.speed = speed
+
+    def accelerate(self):
+        x_velocity, y_velocity = np.cos(self.body.angle), np.sin(self.body.angle)
+        self.body.velocity = Vec2d(x_velocity, y_velocity) * self.speed
+
+    def stop(self):
+        self.speed = abs(self.body.velocity)
+        self.body.velocity = Vec2d(0, 0)
+
+    def check_boundaries(self, WIDTH: int, HEIGHT: int,
+                         cyclic_horizontal: bool = True, cyclic_vertical: bool = True):
+        if cyclic_horizontal:
+            if self.body.position[0] >= WIDTH:
+                self.body.position = (0, self.body.position[1])
+            elif self.body.position[0] <= 0:
+                self.body.position = (WIDTH, self.body.position[1])
+        else:
+            if self.body.position[0] > WIDTH:
+                self.body.position = (WIDTH, self.body.position[1])
+            elif self.body.position[0] < 0:
+                self.body.position = (0, self.body.position[1])
+
+        if cyclic_vertical:
+            if self.body.position[1] >= HEIGHT:
+                self.body.position = (self.body.position[0], 0)
+            elif self.body.position[1] <= 0:
+                self.body.position = (self.body.position[0], HEIGHT)
+        else:
+            if self.body.position[1] > HEIGHT:
+                self.body.position = (self.body.position[0], HEIGHT)
+            elif self.body.position[1] < 0:
+                self.body.position = (self.body.position[0], 0)
@@ -1,14 +1,70 @@
+import argparse
 import sys
+import threading
 import pygame
-import pymunk
-import pymunk.pygame_util
 from Flock import Flock
+from BoidRenderer import BoidRenderer, ProfilerOverlay
+from FrameProfiler import FrameProfiler
+from SimulationThread import SimulationThread
+from TrajectoryPlayer import TrajectoryPlayer
 from UserInterface import UserInterface
 import thorpy as tp
-from time import time
+from time import perf_counter
 
 
-def main():
+def parse_arguments(arguments: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Boid flocking simulation.')
+    parser.add_argument('--replay', default=None, help='play a recorded trajectory file instead of simulating')
+    return parser.parse_args(arguments)
+
+
+def replay(window: pygame.Surface, clock: pygame.time.Clock, fps: int, path: str):
+    # space pauses, left and right seek by a second, up and down change the speed, home and end jump
+    player = TrajectoryPlayer(path)
+    renderer = BoidRenderer(window, scale=player.get_boid_scale())
+    # the renderer kernels are compiled before the first frame is drawn, as in the simulation
+    renderer.warm_up()
+    print(f'replaying {player.number_of_frames} frames of {player.header["boids"]} boids')
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type != pygame.KEYDOWN:
+                continue
+            elif event.key == pygame.K_ESCAPE:
+                running = False
+            elif event.key == pygame.K_SPACE:
+                player.toggle()
+            elif event.key in (pygame.K_LEFT, pygame.K_RIGHT):
+                player.seek_time(1 if event.key == pygame.K_RIGHT else -1)
+            elif event.key in (pygame.K_UP, pygame.K_DOWN):
+                player.change_speed(1 if event.key == pygame.K_UP else -1)
+                print(f'replay speed {player.speed}x')
+            elif event.key == pygame.K_HOME:
+                player.seek(0)
+            elif event.key == pygame.K_END:
+                player.seek(player.number_of_frames - 1)
+            elif event.key == pygame.K_v:
+                renderer.next_mode()
+                print(f'render mode {renderer.mode}')
+            elif event.key == pygame.K_c:
+                renderer.toggle_heading_colors()
+            elif event.key == pygame.K_f:
+                print(f'frame {int(player.cursor)} of {player.number_of_frames}')
+
+        window.fill((11, 11, 11))
+        renderer.draw(player.get_frame())
+        pygame.display.update()
+        player.advance()
+        clock.tick(fps)
+    player.close()
+
+
+def main(arguments: list[str] | None = None):
+    arguments = parse_arguments(arguments)
+    start_time = perf_counter()
+    first_frame = True
     running = True
     pygame.init()
     WIDTH, HEIGHT = 1920, 1080
@@ -16,24 +72,30 @@ def main():
     clock = pygame.time.Clock()
     fps = 30
     dt = 1 / fps
-    use_numba = True
-
-    space = pymunk.Space()
-    user_interface = UserInterface(window, WIDTH, HEIGHT, margin=50)
-    simulation_parameters = user_interface.get_parameters()
-    # print(simulation_parameters)
+    if arguments.replay is not None:
+        replay(window, clock, fps, arguments.replay)
+        pygame.quit()
+        return
 
-    check_boundaries = True
-    horizontal_cyclic_boundary = False
-    vertical_cyclic_boundary = True
-    separation_active = True
-    alignment_active = False
-    cohesion_active = True
-    horizontal_wall_active = True
-    vertical_wall_active = True
+    rules = dict(check_boundaries=True,
+                 horizontal_cyclic_boundary=False,
+                 vertical_cyclic_boundary=True,
+                 separation_active=True,
+                 alignment_active=False,
+                 cohesion_active=True,
+                 horizontal_wall_active=True,
+                 vertical_wall_active=True)
+    rule_keys = {pygame.K_1: 'check_boundaries',
+                 pygame.K_2: 'horizontal_cyclic_boundary',
+                 pygame.K_3: 'vertical_cyclic_boundary',
+                 pygame.K_4: 'separation_active',
+                 pygame.K_5: 'alignment_active',
+                 pygame.K_6: 'cohesion_active',
+                 pygame.K_7: 'horizontal_wall_active',
+                 pygame.K_8: 'vertical_wall_active'}
 
     number_of_bodies = 1300
-    flock = Flock(number_of_bodies, space,
+    flock = Flock(number_of_bodies, None,
                   space_coordinates=(WIDTH, HEIGHT),
                   boid_size=2,
                   speed_scale=200,
@@ -48,10 +110,23 @@ def main():
                   turn_margin=80,
                   turn_factor=20)
 
-    draw_options = pymunk.pygame_util.DrawOptions(window)
+    renderer = BoidRenderer(window, scale=flock.boid_scale)
+    # the flock is only changed by the simulation thread, the render loop sends commands to it, so like the
+    # rules the speed and backend last asked for are kept here, the flock still holds the old ones until the
+    # simulation thread gets to the command
+    speed_active, backend = flock.speed_active, flock.backend
+    simulation = SimulationThread(flock, dt, rules)
+    simulation.start()
+    threading.Thread(target=renderer.warm_up, daemon=True).start()
+
+    user_interface = UserInterface(window, WIDTH, HEIGHT, margin=50)
+    simulation_parameters = user_interface.get_parameters()
+    # print(simulation_parameters)
+    profiler = FrameProfiler(('events', 'draw', 'overlay', 'interface', 'display', 'idle'))
+    overlay = ProfilerOverlay({'render': profiler, 'simulation': simulation.profiler})
 
-    fps_time = 0
     while running:
+        profiler.begin_frame()
         mouse_rel = pygame.mouse.get_rel()
         events = pygame.event.get()
         for event in events:
@@ -65,81 +140,62 @@ def main():
                 else:
                     user_interface.activate_menu()
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                if flock.speed_active:
-                    # simulation_parameters.speed_active = False
-                    flock.stop_boids()
-                else:
-                    # simulation_parameters.speed_active = True
-                    flock.accelerate_boids()
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_1:
-                check_boundaries = not check_boundaries
-                print(f'check_boundaries {check_boundaries}')
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_2:
-                horizontal_cyclic_boundary = not horizontal_cyclic_boundary
-                print(f'horizontal_cyclic_boundary {horizontal_cyclic_boundary}')
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_3:
-                vertical_cyclic_boundary = not vertical_cyclic_boundary
-                print(f'vertical_cyclic_boundary {vertical_cyclic_boundary}')
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_4:
-                separation_active = not separation_active
-                print(f'separation_active {separation_active}')
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_5:
-                alignment_active = not alignment_active
-                print(f'alignment_active {alignment_active}')
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_6:
-                cohesion_active = not cohesion_active
-                print(f'cohesion_active {cohesion_active}')
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_7:
-                horizontal_wall_active = not horizontal_wall_active
-                print(f'horizontal_wall_active {horizontal_wall_active}')
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_8:
-                vertical_wall_active = not vertical_wall_active
-                print(f'vertical_wall_active {vertical_wall_active}')
+                speed_active = not speed_active
+                simulation.send(flock.accelerate_boids if speed_active else flock.stop_boids)
+            elif event.type == pygame.KEYDOWN and event.key in rule_keys:
+                rule = rule_keys[event.key]
+                rules[rule] = not rules[rule]
+                simulation.send(simulation.set_rule, rule, rules[rule])
+                print(f'{rule} {rules[rule]}')
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_r:
-                flock.reset_boids()
+                simulation.send(flock.reset_boids)
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_n:
-                use_numba = not use_numba
-                print(f'use numba {use_numba}')
+                backends = flock.get_available_backends()
+                backend = backends[(backends.index(backend) + 1) % len(backends)]
+                simulation.send(flock.set_backend, backend)
+                print(f'backend {backend}')
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_v:
+                renderer.next_mode()
+                print(f'render mode {renderer.mode}')
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_c:
+                renderer.toggle_heading_colors()
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_f:
-                print(f'frame time: {fps_time:.6}')
-
-        # if simulation_parameters != user_interface.get_parameters():
-        #     simulation_parameters = user_interface.get_parameters()
-        #     flock.update_parameters(simulation_parameters)
-        if flock.speed_active:
-            start = time()
-            if use_numba:
-                flock.update_boid_velocity_with_numba(
-                    check_boundaries=check_boundaries,
-                    horizontal_cyclic_boundary=horizontal_cyclic_boundary,
-                    vertical_cyclic_boundary=vertical_cyclic_boundary,
-                    separation_active=separation_active,
-                    alignment_active=alignment_active,
-                    cohesion_active=cohesion_active,
-                    vertical_wall_active=vertical_wall_active,
-                    horizontal_wall_active=horizontal_wall_active
-                )
-            else:
-                flock.update_boid_velocity(
-                    check_boundaries=check_boundaries,
-                    horizontal_cyclic_boundary=horizontal_cyclic_boundary,
-                    vertical_cyclic_boundary=vertical_cyclic_boundary,
-                    separation_active=separation_active,
-                    alignment_active=alignment_active,
-                    cohesion_active=cohesion_active,
-                    vertical_wall_active=vertical_wall_active,
-                    horizontal_wall_active=horizontal_wall_active
-                )
-            fps_time = time() - start
-
-        # user_interface.parameter_changed()
+                print(f'frame time: {simulation.frame_time:.6}, recompilations: {flock.recompilations}')
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_h:
+                overlay.toggle()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_e:
+                profiler.export_csv('profile_render.csv')
+                simulation.profiler.export_csv('profile_simulation.csv')
+                print('frame profiles exported to profile_render.csv and profile_simulation.csv')
+        # only the fields of the widgets released since the last frame are passed on
+        changes = user_interface.pop_changes()
+        if changes:
+            simulation.send(simulation.set_parameters, changes)
+            for field, rule in simulation.rule_fields.items():
+                if field in changes:
+                    rules[rule] = changes[field]
+            if 'boid' in changes:
+                renderer.set_scale(changes['boid'])
+        profiler.mark('events')
+
         window.fill((11, 11, 11))
-        space.debug_draw(draw_options)
+        with simulation.front_snapshot() as snapshot:
+            renderer.draw(snapshot)
+        profiler.mark('draw')
+        overlay.draw(window)
+        profiler.mark('overlay')
         user_interface.update(events, mouse_rel)
+        profiler.mark('interface')
         pygame.display.update()
-        space.step(dt)
+        profiler.mark('display')
+        if first_frame:
+            first_frame = False
+            print(f'time to first frame: {perf_counter() - start_time:.3f} s')
         clock.tick(fps)
+        profiler.mark('idle')
+        profiler.end_frame()
 
+    simulation.stop()
     pygame.quit()
 
 
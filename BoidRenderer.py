@@ -0,0 +1,359 @@
+import numpy as np
+import pygame
+from collections import OrderedDict
+from FlockCore import FlockState, NUMBA_AVAILABLE, nb
+from FrameProfiler import FrameProfiler
+
+
+class SpriteCache:
+    def __init__(self, angle_buckets: int = 64, color_levels: int = 16, max_size: int = 4096):
+        self.angle_buckets = angle_buckets
+        self.color_levels = color_levels
+        self.max_size = max_size
+        self.sprites = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_angle_buckets(self, angles: np.ndarray):
+        return np.round(angles * self.angle_buckets / (2 * np.pi)).astype(np.int64) % self.angle_buckets
+
+    def get_color_buckets(self, colors: np.ndarray):
+        # rgb channels are quantized to color_levels levels and packed into one integer
+        levels = (colors[:, :3].astype(np.int64) * self.color_levels) // 256
+        return (levels[:, 0] * self.color_levels + levels[:, 1]) * self.color_levels + levels[:, 2]
+
+    def get_bucket_color(self, color_bucket: int):
+        step = 256 // self.color_levels
+        blue = color_bucket % self.color_levels
+        green = color_bucket // self.color_levels % self.color_levels
+        red = color_bucket // self.color_levels ** 2
+        return tuple(int(level * step + step // 2) for level in (red, green, blue))
+
+    def get_sprite(self, scale: float, angle_bucket: int, color_bucket: int):
+        key = (scale, angle_bucket, color_bucket)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            self.hits += 1
+            return sprite
+        self.misses += 1
+        sprite = self.create_sprite(scale, angle_bucket * 2 * np.pi / self.angle_buckets,
+                                    self.get_bucket_color(color_bucket))
+        self.sprites[key] = sprite
+        if len(self.sprites) > self.max_size:
+            self.sprites.popitem(last=False)
+        return sprite
+
+    @staticmethod
+    def create_sprite(scale: float, angle: float, color: tuple[int, int, int]):
+        triangle = np.array([(0, 1 * scale), (0, -1 * scale), (3 * scale, 0)], dtype=np.float64)
+        cos, sin = np.cos(angle), np.sin(angle)
+        vertices = np.column_stack((triangle[:, 0] * cos - triangle[:, 1] * sin,
+                                    triangle[:, 0] * sin + triangle[:, 1] * cos))
+        offset = np.floor(vertices.min(axis=0))
+        size = np.ceil(vertices.max(axis=0) - offset).astype(int) + 1
+        surface = pygame.Surface(tuple(size))
+        pygame.draw.polygon(surface, color, (vertices - offset).tolist())
+        # boid colors are never pure black, so black is the transparent background
+        surface.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+        return surface, offset
+
+    def clear(self):
+        self.sprites.clear()
+
+
+class BoidRenderer:
+    modes = ('auto', 'raster', 'sprite', 'polygon', 'heatmap')
+
+    def __init__(self, window: pygame.Surface, scale: float = 1, mode: str = 'auto',
+                 heatmap_boids: int = 200_000, min_boid_length: float = 1, heading_colors: bool = True):
+        self.window = window
+        self.scale = scale
+        self.sprite_cache = SpriteCache()
+        self.mode = None
+        self.set_mode(mode)
+        # the numba rasteriser is the fast path, plain python rasterisation would be far slower than polygons
+        self.triangle_mode = 'raster' if NUMBA_AVAILABLE else 'polygon'
+        # the auto mode draws a heatmap from heatmap_boids boids on, or once boids are shorter than min_boid_length
+        # pixels, triangles would only cover each other or be single pixels by then
+        self.heatmap_boids = heatmap_boids
+        self.min_boid_length = min_boid_length
+        self.heading_colors = heading_colors
+        self.heatmap = None
+        self.raster_pixels = None
+
+    def set_mode(self, mode: str):
+        if mode not in self.modes:
+            raise ValueError(f'render mode {mode} is not one of {self.modes}')
+        self.mode = mode
+
+    def set_scale(self, scale: float):
+        # sprites of the old size are never drawn again, sprites of the new size are built once they are drawn
+        if scale != self.scale:
+            self.scale = scale
+            self.sprite_cache.clear()
+
+    def next_mode(self):
+        self.set_mode(self.modes[(self.modes.index(self.mode) + 1) % len(self.modes)])
+
+    def toggle_heading_colors(self):
+        self.heading_colors = not self.heading_colors
+
+    def get_draw_mode(self, state: FlockState):
+        if self.mode != 'auto':
+            return self.mode
+        # the boid triangle is three times the scale long
+        if state.number_of_boids >= self.heatmap_boids or 3 * self.scale < self.min_boid_length:
+            return 'heatmap'
+        return self.triangle_mode
+
+    def get_triangle(self):
+        # the same triangle as Boid.create, pointing along the boid angle
+        return np.array([(0, 1 * self.scale), (0, -1 * self.scale), (3 * self.scale, 0)], dtype=np.float64)
+
+    def get_vertices(self, state: FlockState):
+        triangle = self.get_triangle()
+        cos, sin = np.cos(state.angle)[:, np.newaxis], np.sin(state.angle)[:, np.newaxis]
+        vertices = np.empty((state.number_of_boids, 3, 2), dtype=np.float64)
+        vertices[:, :, 0] = state.position[:, 0, np.newaxis] + triangle[:, 0] * cos - triangle[:, 1] * sin
+        vertices[:, :, 1] = state.position[:, 1, np.newaxis] + triangle[:, 0] * sin + triangle[:, 1] * cos
+        return vertices
+
+    def map_colors(self, colors: np.ndarray):
+        # the same packing as Surface.map_rgb, vectorized over the flock
+        mapped_colors = np.zeros(colors.shape[0], dtype=np.int64)
+        for channel, (shift, loss) in enumerate(zip(self.window.get_shifts(), self.window.get_losses())):
+            mapped_colors |= (colors[:, channel].astype(np.int64) >> loss) << shift
+        return mapped_colors
+
+    def draw_sprites(self, state: FlockState):
+        angle_buckets = self.sprite_cache.get_angle_buckets(state.angle)
+        color_buckets = self.sprite_cache.get_color_buckets(state.color)
+        color_count = self.sprite_cache.color_levels ** 3
+        # every sprite used in this frame is looked up in the cache once
+        keys, boid_keys = np.unique(angle_buckets * color_count + color_buckets, return_inverse=True)
+        sprites, offsets = [], np.empty((keys.size, 2), dtype=np.float64)
+        for index, key in enumerate(keys.tolist()):
+            sprite, offset = self.sprite_cache.get_sprite(self.scale, *divmod(key, color_count))
+            sprites.append(sprite)
+            offsets[index] = offset
+        destinations = (state.position + offsets[boid_keys]).astype(np.int64).tolist()
+        self.window.blits([(sprites[key], destination)
+                           for key, destination in zip(boid_keys.tolist(), destinations)], doreturn=False)
+
+    def draw_raster(self, vertices: np.ndarray, colors: np.ndarray):
+        # the window stays locked while an array of its pixels is alive, and a compiling rasteriser keeps its
+        # arguments alive past the call, so the triangles go to a buffer of the renderer and the window pixels
+        # are only held by the copies in and out, the column major buffer matches the layout of surfarray
+        pixels = pygame.surfarray.pixels2d(self.window)
+        if self.raster_pixels is None or self.raster_pixels.shape != pixels.shape \
+                or self.raster_pixels.dtype != pixels.dtype:
+            self.raster_pixels = np.empty(pixels.shape, dtype=pixels.dtype, order='F')
+        self.raster_pixels[:] = pixels
+        del pixels
+        rasterize_triangles(self.raster_pixels, vertices, self.map_colors(colors).astype(self.raster_pixels.dtype))
+        pixels = pygame.surfarray.pixels2d(self.window)
+        pixels[:] = self.raster_pixels
+        del pixels
+
+    def draw_heatmap(self, state: FlockState):
+        if self.heatmap is None or self.heatmap.size != self.window.get_size():
+            self.heatmap = Heatmap(self.window.get_size())
+        self.heatmap.accumulate(state.position, state.angle)
+        pygame.surfarray.blit_array(self.window, self.heatmap.shade(self.heading_colors))
+
+    def warm_up(self):
+        # compiles the rasteriser for the pixel format of the window on a tiny surface of the same format,
+        # and the heatmap scatter for the dtypes of simulated and replayed positions
+        if NUMBA_AVAILABLE and self.window.get_bytesize() in (2, 4):
+            surface = pygame.Surface((4, 4), 0, self.window)
+            # the same column major buffer of the pixel type of the window as draw_raster
+            pixels = np.zeros(surface.get_size(), dtype=pygame.surfarray.pixels2d(surface).dtype, order='F')
+            vertices = np.zeros((1, 3, 2), dtype=np.float64)
+            rasterize_triangles(pixels, vertices, np.zeros(1, dtype=pixels.dtype))
+        if NUMBA_AVAILABLE:
+            heatmap = Heatmap((4, 4))
+            for dtype in (np.float64, np.float32):
+                heatmap.accumulate(np.zeros((1, 2), dtype=dtype), np.zeros(1, dtype=dtype))
+            heatmap.shade()
+
+    def draw(self, state: FlockState):
+        mode = self.get_draw_mode(state)
+        if mode == 'heatmap':
+            self.draw_heatmap(state)
+            return
+        if mode == 'sprite':
+            self.draw_sprites(state)
+            return
+        vertices = self.get_vertices(state)
+        if mode == 'raster' and self.window.get_bytesize() in (2, 4):
+            self.draw_raster(vertices, state.color)
+        else:
+            for boid_vertices, color in zip(vertices.tolist(), state.color.tolist()):
+                pygame.draw.polygon(self.window, color, boid_vertices)
+
+
+class Heatmap:
+    def __init__(self, size: tuple[int, int], background: tuple[int, int, int] = (11, 11, 11)):
+        # one bin per screen pixel in the column major layout of surfarray, with the number of boids in a pixel
+        # and the sum of their heading vectors
+        self.size = tuple(size)
+        self.counts = np.zeros(self.size, dtype=np.int32)
+        self.headings = np.zeros(self.size + (2,), dtype=np.float32)
+        self.pixels = np.empty(self.size + (3,), dtype=np.uint8)
+        self.background = np.array(background, dtype=np.uint8)
+        levels = np.linspace(0, 1, 256)[:, np.newaxis]
+        # density runs from the background to white through the blue of the boids, heading is a hue wheel
+        self.density_colors = levels ** np.array([2, 1.5, 0.5]) * 255 + self.background * (1 - levels)
+        hues = np.linspace(0, 1, 256, endpoint=False)[:, np.newaxis]
+        self.hue_colors = 127.5 + 127.5 * np.cos(2 * np.pi * (hues - np.array([0, 1, 2]) / 3))
+
+    def accumulate(self, positions: np.ndarray, angles: np.ndarray):
+        if NUMBA_AVAILABLE:
+            self.counts[:] = 0
+            self.headings[:] = 0
+            accumulate_heatmap(positions, angles, self.counts, self.headings)
+            return
+        bins, bin_range = self.size, ((0, self.size[0]), (0, self.size[1]))
+        x, y = positions[:, 0], positions[:, 1]
+        self.counts[:] = np.histogram2d(x, y, bins=bins, range=bin_range)[0]
+        self.headings[..., 0] = np.histogram2d(x, y, bins=bins, range=bin_range, weights=np.cos(angles))[0]
+        self.headings[..., 1] = np.histogram2d(x, y, bins=bins, range=bin_range, weights=np.sin(angles))[0]
+
+    def shade(self, heading_colors: bool = True):
+        # brightness follows the logarithm of the count, so single boids stay visible next to dense clusters
+        if NUMBA_AVAILABLE:
+            shade_heatmap(self.counts, self.headings, heading_colors, self.density_colors, self.hue_colors,
+                          self.background, self.pixels)
+            return self.pixels
+        self.pixels[:] = self.background
+        occupied = self.counts > 0
+        counts = self.counts[occupied]
+        if counts.size == 0:
+            return self.pixels
+        density = np.log1p(counts) / np.log1p(counts.max())
+        if heading_colors:
+            headings = self.headings[occupied]
+            hue = np.arctan2(headings[:, 1], headings[:, 0]) / (2 * np.pi) % 1
+            colors = self.hue_colors[(hue * 256).astype(np.int64) % 256]
+            colors = colors * density[:, np.newaxis] + self.background * (1 - density[:, np.newaxis])
+        else:
+            colors = self.density_colors[(density * 255).astype(np.int64)]
+        self.pixels[occupied] = colors
+        return self.pixels
+
+
+class ProfilerOverlay:
+    def __init__(self, profilers: dict[str, FrameProfiler], refresh_frames: int = 15, font_size: int = 16):
+        self.profilers = profilers
+        self.refresh_frames = refresh_frames
+        self.font_size = font_size
+        self.visible = False
+        self.font = None
+        self.surface = None
+        self.frames = 0
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.surface = None
+
+    def render(self):
+        if self.font is None:
+            self.font = pygame.font.SysFont('monospace', self.font_size)
+        lines = []
+        for name, profiler in self.profilers.items():
+            lines.append(f"{name:<12} {'p50':>8} {'p95':>8} {'p99':>8} ms")
+            percentiles = profiler.get_percentiles() * 1000
+            for phase, (p50, p95, p99) in zip(profiler.phases + ('total',), percentiles.T):
+                lines.append(f'  {phase:<10} {p50:8.3f} {p95:8.3f} {p99:8.3f}')
+        texts = [self.font.render(line, True, (230, 230, 230)) for line in lines]
+        line_height = self.font.get_linesize()
+        surface = pygame.Surface((max(text.get_width() for text in texts) + 16, line_height * len(texts) + 16),
+                                 pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 170))
+        for index, text in enumerate(texts):
+            surface.blit(text, (8, 8 + index * line_height))
+        return surface
+
+    def draw(self, window: pygame.Surface):
+        # percentiles and text are only rebuilt every refresh_frames frames, in between the last surface is blitted
+        if not self.visible:
+            return
+        if self.surface is None or self.frames % self.refresh_frames == 0:
+            self.surface = self.render()
+        self.frames += 1
+        window.blit(self.surface, (10, 10))
+
+
+@nb.njit(nogil=True, cache=True)
+def rasterize_triangles(pixels, vertices, colors):
+    width, height = pixels.shape
+    for index in range(vertices.shape[0]):
+        x0, y0 = vertices[index, 0, 0], vertices[index, 0, 1]
+        x1, y1 = vertices[index, 1, 0], vertices[index, 1, 1]
+        x2, y2 = vertices[index, 2, 0], vertices[index, 2, 1]
+        color = colors[index]
+        # the pixel under the base of the triangle is always drawn, so sub pixel boids stay visible
+        base_x, base_y = int(np.floor((x0 + x1) / 2)), int(np.floor((y0 + y1) / 2))
+        if 0 <= base_x < width and 0 <= base_y < height:
+            pixels[base_x, base_y] = color
+        area = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+        if area == 0:
+            continue
+        min_x = max(int(np.floor(min(x0, x1, x2))), 0)
+        max_x = min(int(np.ceil(max(x0, x1, x2))), width - 1)
+        min_y = max(int(np.floor(min(y0, y1, y2))), 0)
+        max_y = min(int(np.ceil(max(y0, y1, y2))), height - 1)
+        for pixel_y in range(min_y, max_y + 1):
+            center_y = pixel_y + 0.5
+            for pixel_x in range(min_x, max_x + 1):
+                center_x = pixel_x + 0.5
+                edge_0 = (x1 - center_x) * (y2 - center_y) - (x2 - center_x) * (y1 - center_y)
+                edge_1 = (x2 - center_x) * (y0 - center_y) - (x0 - center_x) * (y2 - center_y)
+                edge_2 = (x0 - center_x) * (y1 - center_y) - (x1 - center_x) * (y0 - center_y)
+                if area > 0:
+                    inside = edge_0 >= 0 and edge_1 >= 0 and edge_2 >= 0
+                else:
+                    inside = edge_0 <= 0 and edge_1 <= 0 and edge_2 <= 0
+                if inside:
+                    pixels[pixel_x, pixel_y] = color
+
+
+@nb.njit(nogil=True, cache=True)
+def accumulate_heatmap(positions, angles, counts, headings):
+    # scatter add of every boid into the pixel under it, boids outside of the window are left out
+    width, height = counts.shape
+    for index in range(positions.shape[0]):
+        pixel_x, pixel_y = int(np.floor(positions[index, 0])), int(np.floor(positions[index, 1]))
+        if 0 <= pixel_x < width and 0 <= pixel_y < height:
+            counts[pixel_x, pixel_y] += 1
+            headings[pixel_x, pixel_y, 0] += np.cos(angles[index])
+            headings[pixel_x, pixel_y, 1] += np.sin(angles[index])
+
+
+@nb.njit(nogil=True, cache=True)
+def shade_heatmap(counts, headings, heading_colors, density_colors, hue_colors, background, pixels):
+    # the same colors as the numpy path of Heatmap.shade in one pass over the pixels
+    width, height = counts.shape
+    max_count = 0
+    for pixel_x in range(width):
+        for pixel_y in range(height):
+            max_count = max(max_count, counts[pixel_x, pixel_y])
+    log_max = np.log1p(max(max_count, 1))
+    for pixel_x in range(width):
+        for pixel_y in range(height):
+            count = counts[pixel_x, pixel_y]
+            if count == 0:
+                for channel in range(3):
+                    pixels[pixel_x, pixel_y, channel] = background[channel]
+                continue
+            density = np.log1p(count) / log_max
+            if heading_colors:
+                hue = np.arctan2(headings[pixel_x, pixel_y, 1], headings[pixel_x, pixel_y, 0]) / (2 * np.pi) % 1
+                hue_index = int(hue * 256) % 256
+                for channel in range(3):
+                    pixels[pixel_x, pixel_y, channel] = int(hue_colors[hue_index, channel] * density
+                                                            + background[channel] * (1 - density))
+            else:
+                for channel in range(3):
+                    pixels[pixel_x, pixel_y, channel] = int(density_colors[int(density * 255), channel])
@@ -0,0 +1,163 @@
+import multiprocessing as mp
+import numpy as np
+from multiprocessing import shared_memory
+from Flock import Flock
+from FlockCore import build_cell_list, compile_kernel, step_flock_grid_numba, nb
+
+
+class SharedFlockArrays:
+    def __init__(self, number_of_boids: int, names: dict[str, str] | None = None, dtype: type = np.float64):
+        # positions and velocities are double buffered, workers read one buffer and write the other
+        shapes = {
+            'position': (2, number_of_boids, 2),
+            'velocity': (2, number_of_boids, 2),
+            'angle': (number_of_boids,),
+            'speed': (number_of_boids,),
+        }
+        self.memory = {}
+        for name, shape in shapes.items():
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            if names is None:
+                self.memory[name] = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                self.memory[name] = shared_memory.SharedMemory(name=names[name])
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=self.memory[name].buf))
+
+    def get_names(self):
+        return {name: memory.name for name, memory in self.memory.items()}
+
+    def close(self):
+        for name in self.memory:
+            setattr(self, name, None)
+        for memory in self.memory.values():
+            memory.close()
+
+    def unlink(self):
+        for memory in self.memory.values():
+            memory.unlink()
+
+
+def step_strip(arrays: SharedFlockArrays, current: int, strip: tuple[float, float], parameters: np.ndarray, kernel):
+    positions, velocities = arrays.position[current], arrays.velocity[current]
+    left, right = strip
+    record = parameters[0]
+    halo = record['cell_size']
+    # the halo holds every boid that can be a neighbor of a boid in the strip, boids migrate between strips
+    # simply by being owned by the strip their position falls into at the start of the step
+    x = positions[:, 0]
+    in_halo = (x >= left - halo) & (x < right + halo)
+    if record['check_boundaries'] and record['horizontal_cyclic_boundary']:
+        # across a cyclic edge the halo continues on the other side of the world, the kernel itself takes
+        # the nearest image of those boids
+        width = record['width']
+        inner_left, inner_right = max(left, 0), min(right, width)
+        in_halo |= (x - width >= inner_left - halo) | (x + width < inner_right + halo)
+    local_boids = np.flatnonzero(in_halo)
+    local_positions, local_velocities = positions[local_boids], velocities[local_boids]
+    owned_boids = np.flatnonzero((local_positions[:, 0] >= left) & (local_positions[:, 0] < right))
+    next_positions = np.empty((owned_boids.size, 2), dtype=positions.dtype)
+    next_velocities = np.empty((owned_boids.size, 2), dtype=positions.dtype)
+    angles = np.empty(owned_boids.size, dtype=positions.dtype)
+    speeds = np.empty(owned_boids.size, dtype=positions.dtype)
+    cell_start, cell_boids = build_cell_list(local_positions, parameters)
+    kernel(local_positions, local_velocities, cell_start, cell_boids, parameters,
+           owned_boids, next_positions, next_velocities, angles, speeds)
+    boids = local_boids[owned_boids]
+    arrays.position[1 - current][boids] = next_positions
+    arrays.velocity[1 - current][boids] = next_velocities
+    arrays.angle[boids] = angles
+    arrays.speed[boids] = speeds
+
+
+def run_strip_worker(connection, names: dict[str, str], number_of_boids: int, strip: tuple[float, float],
+                     parallel: bool, threads: int, fastmath: bool, dtype: str):
+    arrays = SharedFlockArrays(number_of_boids, names, dtype)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        current, parameters, pair_rules = message
+        if parallel:
+            nb.set_num_threads(threads)
+        kernel = compile_kernel(step_flock_grid_numba, parallel, fastmath, pair_rules)
+        step_strip(arrays, current, strip, parameters, kernel)
+        connection.send(True)
+    arrays.close()
+
+
+class DecomposedFlock:
+    def __init__(self, flock: Flock, workers: int):
+        self.flock = flock
+        self.workers = workers
+        self.arrays = SharedFlockArrays(flock.number_of_boids, dtype=flock.dtype)
+        self.arrays.position[0] = flock.state.position
+        self.arrays.velocity[0] = flock.state.velocity
+        self.arrays.angle[:] = flock.state.angle
+        self.arrays.speed[:] = flock.state.speed
+        self.current = 0
+        self.bind_state()
+
+        # vertical strips of the world, the outer strips also own boids outside of the window
+        edges = np.linspace(0, flock.WIDTH, workers + 1)
+        edges[0], edges[-1] = -np.inf, np.inf
+        context = mp.get_context('spawn')
+        self.connections, self.processes = [], []
+        for left, right in zip(edges[:-1], edges[1:]):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=run_strip_worker,
+                                      args=(worker_connection, self.arrays.get_names(), flock.number_of_boids,
+                                            (left, right), flock.parallel, max(flock.threads // workers, 1),
+                                            flock.fastmath, flock.dtype.name),
+                                      daemon=True)
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def bind_state(self):
+        # the flock state is a view of the shared buffers, so rendering and recording need no copies
+        state, current, back = self.flock.state, self.current, 1 - self.current
+        state.position, state.next_position = self.arrays.position[current], self.arrays.position[back]
+        state.velocity, state.next_velocity = self.arrays.velocity[current], self.arrays.velocity[back]
+        state.angle, state.speed = self.arrays.angle, self.arrays.speed
+
+    def step(self,
+             dt: float,
+             check_boundaries: bool,
+             horizontal_cyclic_boundary: bool,
+             vertical_cyclic_boundary: bool,
+             separation_active: bool,
+             alignment_active: bool,
+             cohesion_active: bool,
+             vertical_wall_active: bool,
+             horizontal_wall_active: bool):
+        flock = self.flock
+        flock.get_kernel_parameters(dt=dt,
+                                    check_boundaries=check_boundaries,
+                                    horizontal_cyclic_boundary=horizontal_cyclic_boundary,
+                                    vertical_cyclic_boundary=vertical_cyclic_boundary,
+                                    vertical_wall_active=vertical_wall_active,
+                                    horizontal_wall_active=horizontal_wall_active)
+        # the cell size of the record is also the halo width of the strips, the pair rules select the
+        # compiled variant of the step kernel
+        pair_rules = (bool(separation_active), bool(alignment_active), bool(cohesion_active))
+        for connection in self.connections:
+            connection.send((self.current, flock.kernel_parameters, pair_rules))
+        for connection in self.connections:
+            connection.recv()
+        self.current = 1 - self.current
+        self.bind_state()
+        flock.sync_bodies()
+        flock.record_frame()
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join()
+        # the flock gets its own copies back before the shared memory is released
+        state = self.flock.state
+        state.position, state.next_position = state.position.copy(), state.next_position.copy()
+        state.velocity, state.next_velocity = state.velocity.copy(), state.next_velocity.copy()
+        state.angle, state.speed = state.angle.copy(), state.speed.copy()
+        self.arrays.close()
+        self.arrays.unlink()
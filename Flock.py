@@ -1,92 +1,57 @@
-import pymunk
-import pygame
+import copy
+import itertools
+import dataclasses
 import numpy as np
-import numba as nb
-import numpy as np
-from pymunk import Vec2d
-from scipy.spatial import distance
-from UserInterface import BoidFlockingParameters
-from numba.core.errors import NumbaPendingDeprecationWarning
-import warnings
-warnings.simplefilter('ignore', category=NumbaPendingDeprecationWarning)
-
-
-class Boid:
-    def __init__(self, position: tuple[int, int], angle: float,
-                 scale: float = 1, speed: int = 1):
-        self.body = None
-        self.shape = None
-        self.saved_speed = Vec2d(0, 0)
-        self.speed = speed
-        self.create(position, angle, scale)
-
-    def create(self, position: tuple[int, int], angle: float, scale: float):
-        triangle_vertices = [
-            (0, 1 * scale),
-            (0, -1 * scale),
-            (3 * scale, 0)
-        ]
-        self.body = pymunk.Body(body_type=pymunk.Body.KINEMATIC)
-        self.body.position = position
-        self.body.angle = angle
-        self.shape = pymunk.Poly(self.body, triangle_vertices)
-        self.shape.color = (0, np.random.randint(100, 200), 255, 255)
-
-    def change_boid(self, position: tuple[int, int], angle: float, speed_active: bool):
-        self.body.position = position
-        self.body.angle = angle
-        if speed_active:
-            self.accelerate()
-
-    def change_velocity(self, vx: float, vy: float, vmax: int, vmin: int):
-        self.body.angle = np.arctan2(-vx, vy) + np.pi / 2
-        velocity = Vec2d(vx, vy)
-        speed = abs(velocity)
-        if speed >= vmax:
-            self.body.velocity = velocity.normalized() * vmax
-            self.speed = vmax
-        elif speed < vmin:
-            self.body.velocity = velocity.normalized() * vmin
-            self.speed = vmin
-        else:
-            self.body.velocity = velocity
-            self.speed = speed
-
-    def accelerate(self):
-        x_velocity, y_velocity = np.cos(self.body.angle), np.sin(self.body.angle)
-        self.body.velocity = Vec2d(x_velocity, y_velocity) * self.speed
-
-    def stop(self):
-        self.speed = abs(self.body.velocity)
-        self.body.velocity = Vec2d(0, 0)
-
-    def check_boundaries(self, WIDTH: int, HEIGHT: int,
-                         cyclic_horizontal: bool = True, cyclic_vertical: bool = True):
-        if cyclic_horizontal:
-            if self.body.position[0] >= WIDTH:
-                self.body.position = (0, self.body.position[1])
-            elif self.body.position[0] <= 0:
-                self.body.position = (WIDTH, self.body.position[1])
-        else:
-            if self.body.position[0] > WIDTH:
-                self.body.position = (WIDTH, self.body.position[1])
-            elif self.body.position[0] < 0:
-                self.body.position = (0, self.body.position[1])
-
-        if cyclic_vertical:
-            if self.body.position[1] >= HEIGHT:
-                self.body.position = (self.body.position[0], 0)
-            elif self.body.position[1] <= 0:
-                self.body.position = (self.body.position[0], HEIGHT)
-        else:
-            if self.body.position[1] > HEIGHT:
-                self.body.position = (self.body.position[0], HEIGHT)
-            elif self.body.position[1] < 0:
-                self.body.position = (self.body.position[0], 0)
+from time import perf_counter
+from typing import TYPE_CHECKING
+from FlockCore import (FlockState, KERNEL_PARAMETERS, NUMBA_AVAILABLE, nb, compile_kernel,
+                       update_boid_velocity_numpy, update_boid_velocity_kdtree, update_boid_velocity_numba,
+                       build_cell_list, update_boid_velocity_grid_numba, step_flock_grid_numba,
+                       build_neighbor_list, get_max_squared_displacement, update_boid_velocity_verlet_numba,
+                       step_flock_verlet_numba, get_morton_codes)
+if TYPE_CHECKING:
+    # pymunk, scipy, pygame and the user interface are only imported where they are used,
+    # so the headless and numba paths load numpy and numba alone
+    import pymunk
+    from UserInterface import BoidFlockingParameters
+
 
 
 class Flock:
-    def __init__(self, number_of_boids: int, space: pymunk.Space,
+    backends = {
+        'python': 'update_boid_velocity',
+        'numpy': 'update_boid_velocity_with_numpy',
+        'numba': 'update_boid_velocity_with_numba',
+        'grid': 'update_boid_velocity_with_grid',
+        'kdtree': 'update_boid_velocity_with_kdtree',
+        'verlet': 'update_boid_velocity_with_verlet',
+    }
+    numba_backends = ('numba', 'grid', 'verlet')
+    # the kernel of every numba backend that is compiled once per pair rule combination
+    pair_rule_kernels = {
+        'numba': update_boid_velocity_numba,
+        'grid': step_flock_grid_numba,
+        'verlet': step_flock_verlet_numba,
+    }
+    # user interface fields that are copied straight into flock attributes
+    parameter_fields = {
+        'boid': 'boid_scale',
+        'speed_scale': 'speed_scale',
+        'avoid_range': 'avoid_range',
+        'avoid_factor': 'avoid_factor',
+        'align_range': 'align_range',
+        'align_factor': 'align_factor',
+        'cohesion_range': 'cohesion_range',
+        'cohesion_factor': 'cohesion_factor',
+        'boundary_margin': 'turn_margin',
+        'boundary_factor': 'turn_factor',
+    }
+    # phases of a step reported to a FrameProfiler, the fused grid kernel also integrates and applies boundaries
+    phases = ('reorder', 'boundaries', 'neighbors', 'steering', 'integration', 'recording')
+    # steps a verlet list lasts at least, the fastest tradeoff of rebuilds and list length in the benchmark flocks
+    verlet_skin_steps = 2
+
+    def __init__(self, number_of_boids: int, space: 'pymunk.Space | None',
                  space_coordinates: tuple[int, int],
                  boid_size: int = 5,
                  speed_range: tuple[int, int] = (1, 3),
@@ -99,16 +64,30 @@ class Flock:
                  cohesion_range: int = 50,
                  cohesion_factor: float = 0.05,
                  turn_margin: int = 50,
-                 turn_factor: int = 1):
+                 turn_factor: int = 1,
+                 parallel: bool = True,
+                 threads: int | None = None,
+                 fastmath: bool = False,
+                 backend: str | None = None,
+                 tile_memory: int = 256 * 2 ** 20,
+                 verlet_skin: float | None = None,
+                 reorder_interval: int = 100,
+                 dtype: type = np.float64):
         self.number_of_boids = number_of_boids
+        # float64 or float32 positions, velocities, angles and speeds
+        self.dtype = np.dtype(dtype)
+        self.state = FlockState(number_of_boids, self.dtype)
+        self.boid_velocities = np.empty((number_of_boids, 2), dtype=self.dtype)
+        self.boid_indices = np.arange(number_of_boids)
         self.boids = []
         self.boid_scale = boid_size
         self.WIDTH = space_coordinates[0]
         self.HEIGHT = space_coordinates[1]
         self.space = space
         self.speed_active = speed_active
-        self.speed_min, self.speed_max = Vec2d(*speed_range) * speed_scale
+        self.speed_range = speed_range
         self.speed_scale = speed_scale
+        self.speed_min, self.speed_max = self.get_speed_bounds()
         self.avoid_range = avoid_range
         self.avoid_factor = avoid_factor
         self.align_range = align_range
@@ -117,42 +96,285 @@ class Flock:
         self.cohesion_factor = cohesion_factor
         self.turn_margin = turn_margin
         self.turn_factor = turn_factor
+        self.cell_size = self.get_cell_size()
+        self.parallel = parallel
+        if threads is None:
+            threads = nb.config.NUMBA_NUM_THREADS if NUMBA_AVAILABLE else 1
+        self.threads = threads
+        self.fastmath = fastmath
+        self.compile_time = None
+        self.kernel_parameters = np.zeros(1, dtype=KERNEL_PARAMETERS)
+        self.parameters_changed = True
+        self.recompilations = 0
+        # kernel signatures warm_up_variants compiles from its own thread, they are not recompilations
+        self.variant_signatures = set()
+        self.recorder = None
+        self.profiler = None
+        # None sizes the skin from the distance the fastest boid covers in one step
+        self.verlet_skin = verlet_skin
+        self.neighbor_list = None
+        self.neighbor_list_positions = None
+        self.neighbor_list_key = None
+        self.neighbor_list_builds = 0
+        self.neighbor_list_frames = 0
+        # rows of the state are reordered along a Morton curve every reorder_interval steps, 0 never reorders,
+        # boid_ids[row] is the boid a row held when the flock was created
+        self.reorder_interval = reorder_interval
+        self.steps_since_reorder = reorder_interval
+        self.reorders = 0
+        self.boid_ids = np.arange(number_of_boids)
+        self.backend = None
+        self.set_backend(backend if backend is not None else 'grid' if NUMBA_AVAILABLE else 'numpy')
+        self.tile_memory = tile_memory
         self.create_boids()
 
     def create_boids(self):
-        for _ in range(self.number_of_boids):
-            boid = Boid((np.random.randint(self.WIDTH),
-                         np.random.randint(self.HEIGHT)),
-                        np.random.random() * 2 * np.pi,
-                        scale=self.boid_scale,
-                        speed=self.speed_scale)
+        self.randomize_boids()
+        self.state.speed[:] = self.speed_scale
+        self.state.color[:] = (0, 0, 255, 255)
+        self.state.color[:, 1] = np.random.randint(100, 200, size=self.number_of_boids)
+        if self.speed_active:
+            self.accelerate_boids()
+        if self.space is not None:
+            self.create_bodies()
+
+    def create_bodies(self):
+        # pymunk bodies are only kept in sync with the state for physics interop and debug_draw
+        from Boid import Boid
+        for position, angle, color in zip(self.state.position, self.state.angle, self.state.color):
+            boid = Boid(tuple(position), angle, scale=self.boid_scale, speed=self.speed_scale)
+            boid.shape.color = tuple(int(channel) for channel in color)
             self.space.add(boid.body, boid.shape)
             self.boids.append(boid)
 
-    def reset_boids(self):
-        for boid in self.boids:
-            boid.change_boid((np.random.randint(self.WIDTH),
-                              np.random.randint(self.HEIGHT)),
-                             np.random.random() * 2 * np.pi,
-                             self.speed_active)
+    def sync_bodies(self):
+        for boid, position, angle in zip(self.boids, self.state.position, self.state.angle):
+            boid.body.position = tuple(position)
+            boid.body.angle = angle
 
-    def convert_boid_to_tuples(self):
-        return [(*boid.body.position, *boid.body.velocity) for boid in self.boids]
+    def randomize_boids(self):
+        self.state.position[:, 0] = np.random.randint(self.WIDTH, size=self.number_of_boids)
+        self.state.position[:, 1] = np.random.randint(self.HEIGHT, size=self.number_of_boids)
+        self.state.angle[:] = np.random.random(self.number_of_boids) * 2 * np.pi
 
-    # def convert_tuples_to_boids(self, velocities):
-    #     for boid in self.boids:
-    #         boid.body.
+    def reset_boids(self):
+        self.randomize_boids()
+        if self.speed_active:
+            self.accelerate_boids()
+        else:
+            self.state.velocity[:] = 0
+        self.sync_bodies()
 
     def accelerate_boids(self):
-        for boid in self.boids:
-            boid.accelerate()
+        self.state.velocity[:, 0] = np.cos(self.state.angle) * self.state.speed
+        self.state.velocity[:, 1] = np.sin(self.state.angle) * self.state.speed
         self.speed_active = True
 
     def stop_boids(self):
-        for boid in self.boids:
-            boid.stop()
+        self.state.speed[:] = np.hypot(self.state.velocity[:, 0], self.state.velocity[:, 1])
+        self.state.velocity[:] = 0
         self.speed_active = False
 
+    def change_velocity(self, boid_velocities: np.ndarray):
+        vx, vy = boid_velocities[:, 0], boid_velocities[:, 1]
+        self.state.angle[:] = np.arctan2(-vx, vy) + np.pi / 2
+        speed = np.hypot(vx, vy)
+        clamped_speed = np.clip(speed, self.speed_min, self.speed_max)
+        scale = np.divide(clamped_speed, speed, out=np.zeros_like(speed), where=speed > 0)
+        np.multiply(boid_velocities, scale[:, np.newaxis], out=self.state.velocity)
+        self.state.speed[:] = clamped_speed
+
+    def check_boundaries(self, cyclic_horizontal: bool = True, cyclic_vertical: bool = True):
+        for axis, limit, cyclic in ((0, self.WIDTH, cyclic_horizontal), (1, self.HEIGHT, cyclic_vertical)):
+            coordinate = self.state.position[:, axis]
+            above, below = coordinate >= limit, coordinate <= 0
+            if cyclic:
+                coordinate[above] = 0
+                coordinate[below] = limit
+            else:
+                coordinate[above] = limit
+                coordinate[below] = 0
+        self.mark_phase('boundaries')
+
+    @classmethod
+    def get_available_backends(cls):
+        return [backend for backend in cls.backends if NUMBA_AVAILABLE or backend not in cls.numba_backends]
+
+    def set_backend(self, backend: str):
+        if backend not in self.get_available_backends():
+            raise ValueError(f'backend {backend} is not available, choose from {self.get_available_backends()}')
+        self.backend = backend
+
+    def update_boids(self,
+                     check_boundaries: bool,
+                     horizontal_cyclic_boundary: bool,
+                     vertical_cyclic_boundary: bool,
+                     separation_active: bool,
+                     alignment_active: bool,
+                     cohesion_active: bool,
+                     vertical_wall_active: bool,
+                     horizontal_wall_active: bool):
+        update_boid_velocity = getattr(self, self.backends[self.backend])
+        update_boid_velocity(check_boundaries=check_boundaries,
+                             horizontal_cyclic_boundary=horizontal_cyclic_boundary,
+                             vertical_cyclic_boundary=vertical_cyclic_boundary,
+                             separation_active=separation_active,
+                             alignment_active=alignment_active,
+                             cohesion_active=cohesion_active,
+                             vertical_wall_active=vertical_wall_active,
+                             horizontal_wall_active=horizontal_wall_active)
+        self.mark_phase('steering')
+
+    def step(self,
+             dt: float,
+             check_boundaries: bool,
+             horizontal_cyclic_boundary: bool,
+             vertical_cyclic_boundary: bool,
+             separation_active: bool,
+             alignment_active: bool,
+             cohesion_active: bool,
+             vertical_wall_active: bool,
+             horizontal_wall_active: bool):
+        if self.reorder_interval and self.steps_since_reorder >= self.reorder_interval:
+            self.reorder_boids()
+        self.steps_since_reorder += 1
+        self.mark_phase('reorder')
+        if self.backend not in ('grid', 'verlet'):
+            self.update_boids(check_boundaries=check_boundaries,
+                              horizontal_cyclic_boundary=horizontal_cyclic_boundary,
+                              vertical_cyclic_boundary=vertical_cyclic_boundary,
+                              separation_active=separation_active,
+                              alignment_active=alignment_active,
+                              cohesion_active=cohesion_active,
+                              vertical_wall_active=vertical_wall_active,
+                              horizontal_wall_active=horizontal_wall_active)
+            self.move_boids(dt, check_boundaries, horizontal_cyclic_boundary, vertical_cyclic_boundary)
+            self.record_frame()
+            return
+        parameters = self.get_kernel_parameters(dt=dt,
+                                                check_boundaries=check_boundaries,
+                                                horizontal_cyclic_boundary=horizontal_cyclic_boundary,
+                                                vertical_cyclic_boundary=vertical_cyclic_boundary,
+                                                vertical_wall_active=vertical_wall_active,
+                                                horizontal_wall_active=horizontal_wall_active)
+        if self.backend == 'verlet':
+            neighbors = self.update_neighbor_list(parameters, (separation_active, alignment_active, cohesion_active))
+            step_kernel = step_flock_verlet_numba
+        else:
+            neighbors = self.run_kernel(build_cell_list, self.state.position, parameters)
+            step_kernel = step_flock_grid_numba
+        self.mark_phase('neighbors')
+        kernel = self.get_kernel(step_kernel, (separation_active, alignment_active, cohesion_active))
+        self.run_kernel(kernel, self.state.position, self.state.velocity, *neighbors, parameters,
+                        self.boid_indices, self.state.next_position, self.state.next_velocity,
+                        self.state.angle, self.state.speed)
+        self.mark_phase('steering')
+        self.state.swap()
+        self.sync_bodies()
+        self.mark_phase('integration')
+        self.record_frame()
+
+    def reorder_boids(self):
+        # boids that are close in space are moved next to each other in memory, so the neighbor loops read
+        # a few cache lines instead of one per neighbor, the arrays are permuted in place since the snapshots
+        # and the shared memory of a decomposed flock hold views of them
+        order = np.argsort(get_morton_codes(self.state.position, self.WIDTH, self.HEIGHT), kind='stable')
+        state = self.state
+        for array in (state.position, state.velocity, state.angle, state.speed, state.color, self.boid_ids):
+            array[:] = array[order]
+        if self.boids:
+            self.boids = [self.boids[index] for index in order]
+        # the neighbor list holds row indices, it is rebuilt for the new rows
+        self.neighbor_list = None
+        self.steps_since_reorder = 0
+        self.reorders += 1
+
+    def set_recorder(self, recorder):
+        # the recorder gets every frame once the step is done, None stops recording
+        self.recorder = recorder
+
+    def record_frame(self):
+        if self.recorder is not None:
+            self.recorder.record(self.state.position, self.state.velocity, self.boid_ids if self.reorders else None)
+            self.mark_phase('recording')
+
+    def set_profiler(self, profiler):
+        self.profiler = profiler
+
+    def mark_phase(self, phase: str):
+        if self.profiler is not None:
+            self.profiler.mark(phase)
+
+    def warm_up(self, rules: dict[str, bool], number_of_boids: int = 16):
+        # compiles, or loads from the on disk cache, the numba kernels the next step of this flock runs with
+        # these rules, on a copy that holds only a few boids so the flock itself is left untouched, the kernels
+        # of other pair rules and backends are compiled when they are first used or by warm_up_variants
+        start = perf_counter()
+        if NUMBA_AVAILABLE and (self.backend in self.numba_backends or self.reorder_interval):
+            flock = self.get_warm_up_flock(number_of_boids)
+            # the first step reorders the boids with the morton kernel whatever the backend
+            if self.reorder_interval:
+                flock.reorder_boids()
+            if self.backend in self.numba_backends:
+                flock.step(1 / 30, **rules)
+        self.compile_time = perf_counter() - start
+        return self.compile_time
+
+    def warm_up_variants(self, rules: dict[str, bool]):
+        # compiles the kernel variants of every other pair rule combination of the current backend for the
+        # signature warm_up compiled, meant to run in the background once stepping has started, so switching a
+        # rule later never waits for the compiler, the variants are only compiled and never run, two parallel
+        # kernels launched from different threads at once abort the workqueue threading layer
+        if not NUMBA_AVAILABLE or self.backend not in self.numba_backends:
+            return
+        kernel = self.pair_rule_kernels[self.backend]
+        pair_rules = (rules['separation_active'], rules['alignment_active'], rules['cohesion_active'])
+        signatures = compile_kernel(kernel, self.parallel, self.fastmath, pair_rules).signatures
+        if not signatures:
+            return
+        for pair_rules in itertools.product((False, True), repeat=3):
+            variant = compile_kernel(kernel, self.parallel, self.fastmath, pair_rules)
+            # recorded before compiling, a step that runs the variant meanwhile sees it as known
+            self.variant_signatures.add((variant, signatures[-1]))
+            variant.compile(signatures[-1])
+
+    def get_warm_up_flock(self, number_of_boids: int):
+        number_of_boids = min(number_of_boids, self.number_of_boids)
+        flock = copy.copy(self)
+        flock.number_of_boids = number_of_boids
+        flock.boids = []
+        flock.recorder = None
+        flock.profiler = None
+        # kernels compiled for the copy are not recompilations of the flock
+        flock.compile_time = None
+        flock.kernel_parameters = self.kernel_parameters.copy()
+        flock.neighbor_list = None
+        flock.reorder_interval = 0
+        flock.state = FlockState(number_of_boids, self.dtype)
+        flock.state.position[:] = self.state.position[:number_of_boids]
+        flock.state.velocity[:] = self.state.velocity[:number_of_boids]
+        flock.boid_velocities = np.empty((number_of_boids, 2), dtype=self.dtype)
+        flock.boid_indices = np.arange(number_of_boids)
+        flock.boid_ids = np.arange(number_of_boids)
+        return flock
+
+    def get_boxsize(self, check_boundaries: bool, horizontal_cyclic_boundary: bool, vertical_cyclic_boundary: bool):
+        # the length of every cyclic axis for the nearest image of a neighbor, zero leaves the axis non periodic
+        return (self.WIDTH if check_boundaries and horizontal_cyclic_boundary else 0,
+                self.HEIGHT if check_boundaries and vertical_cyclic_boundary else 0)
+
+    def move_boids(self, dt: float, check_boundaries: bool = False,
+                   horizontal_cyclic_boundary: bool = False, vertical_cyclic_boundary: bool = False):
+        # boundaries apply to the integrated positions, as in integrate_boid of the fused steps, so every backend
+        # ends a step with its boids inside the window
+        self.state.position += self.state.velocity * dt
+        self.mark_phase('integration')
+        if check_boundaries:
+            self.check_boundaries(cyclic_horizontal=horizontal_cyclic_boundary,
+                                  cyclic_vertical=vertical_cyclic_boundary)
+        self.sync_bodies()
+        self.mark_phase('integration')
+
     def update_boid_velocity(self,
                              check_boundaries: bool,
                              horizontal_cyclic_boundary: bool,
@@ -162,34 +384,39 @@ class Flock:
                              cohesion_active: bool,
                              vertical_wall_active: bool,
                              horizontal_wall_active: bool):
-        for boid in self.boids:
-            if check_boundaries:
-                boid.check_boundaries(self.WIDTH, self.HEIGHT,
-                                      cyclic_horizontal=horizontal_cyclic_boundary,
-                                      cyclic_vertical=vertical_cyclic_boundary)
-            if any([separation_active, alignment_active, cohesion_active, vertical_wall_active,
-                    horizontal_wall_active]):
+        positions, velocities = self.state.position, self.state.velocity
+        boid_velocities = self.boid_velocities
+        boid_velocities[:] = velocities
+        box_x, box_y = self.get_boxsize(check_boundaries, horizontal_cyclic_boundary, vertical_cyclic_boundary)
+        if any([separation_active, alignment_active, cohesion_active, vertical_wall_active,
+                horizontal_wall_active]):
+            for index in range(self.number_of_boids):
                 close_dx, close_dy = 0, 0
                 xvel_avg, yvel_avg, neighboring_boids_align = 0, 0, 0
                 xpos_avg, ypos_avg, neighboring_boids_cohesion = 0, 0, 0
-                boid_x, boid_y = boid.body.position
-                for other in self.boids:
-                    if other != boid:
-                        other_x, other_y = other.body.position
-                        boid_distance = distance.euclidean(boid.body.position, other.body.position)
-                        if separation_active and boid_distance < self.avoid_range:
-                            # boid_x, boid_y = boid.body.position
-                            close_dx += boid_x - other_x
-                            close_dy += boid_y - other_y
-
-                        if alignment_active and boid_distance < self.align_range:
-                            xvel_avg += other.body.velocity[0]
-                            yvel_avg += other.body.velocity[1]
+                boid_x, boid_y = positions[index]
+                boid_vx, boid_vy = velocities[index]
+                for other in range(self.number_of_boids):
+                    if other != index:
+                        # a neighbor across a cyclic edge is at its nearest image
+                        dx, dy = boid_x - positions[other, 0], boid_y - positions[other, 1]
+                        if box_x:
+                            dx -= box_x * round(dx / box_x)
+                        if box_y:
+                            dy -= box_y * round(dy / box_y)
+                        squared_distance = dx ** 2 + dy ** 2
+                        if separation_active and squared_distance < self.avoid_range ** 2:
+                            close_dx += dx
+                            close_dy += dy
+
+                        if alignment_active and squared_distance < self.align_range ** 2:
+                            xvel_avg += velocities[other, 0]
+                            yvel_avg += velocities[other, 1]
                             neighboring_boids_align += 1
 
-                        if cohesion_active and boid_distance < self.cohesion_range:
-                            xpos_avg += other_x
-                            ypos_avg += other_y
+                        if cohesion_active and squared_distance < self.cohesion_range ** 2:
+                            xpos_avg += boid_x - dx
+                            ypos_avg += boid_y - dy
                             neighboring_boids_cohesion += 1
 
                 separation_vx, separation_vy = 0, 0
@@ -199,8 +426,8 @@ class Flock:
 
                 alignment_vx, alignment_vy = 0, 0
                 if neighboring_boids_align > 0 and alignment_active:
-                    alignment_vx = ((xvel_avg / neighboring_boids_align) - boid.body.velocity[0]) * self.align_factor
-                    alignment_vy = ((yvel_avg / neighboring_boids_align) - boid.body.velocity[1]) * self.align_factor
+                    alignment_vx = ((xvel_avg / neighboring_boids_align) - boid_vx) * self.align_factor
+                    alignment_vy = ((yvel_avg / neighboring_boids_align) - boid_vy) * self.align_factor
 
                 cohesion_vx, cohesion_vy = 0, 0
                 if neighboring_boids_cohesion > 0 and cohesion_active:
@@ -221,11 +448,49 @@ class Flock:
                     elif boid_y > self.HEIGHT - self.turn_margin:
                         wall_vy = -self.turn_factor
 
-                boid.change_velocity(
-                    boid.body.velocity[0] + separation_vx + alignment_vx + cohesion_vx + wall_vx,
-                    boid.body.velocity[1] + separation_vy + alignment_vy + cohesion_vy + wall_vy,
-                    self.speed_max, self.speed_min
-                )
+                boid_velocities[index, 0] = boid_vx + separation_vx + alignment_vx + cohesion_vx + wall_vx
+                boid_velocities[index, 1] = boid_vy + separation_vy + alignment_vy + cohesion_vy + wall_vy
+        self.change_velocity(boid_velocities)
+
+    def update_boid_velocity_with_numpy(self,
+                                        check_boundaries: bool,
+                                        horizontal_cyclic_boundary: bool,
+                                        vertical_cyclic_boundary: bool,
+                                        separation_active: bool,
+                                        alignment_active: bool,
+                                        cohesion_active: bool,
+                                        vertical_wall_active: bool,
+                                        horizontal_wall_active: bool):
+        boxsize = self.get_boxsize(check_boundaries, horizontal_cyclic_boundary, vertical_cyclic_boundary)
+        update_boid_velocity_numpy(self.state.position, self.state.velocity, self.WIDTH, self.HEIGHT,
+                                   separation_active, alignment_active, cohesion_active,
+                                   self.avoid_range, self.avoid_factor,
+                                   self.align_range, self.align_factor,
+                                   self.cohesion_range, self.cohesion_factor,
+                                   horizontal_wall_active, vertical_wall_active,
+                                   self.turn_margin, self.turn_factor, self.boid_velocities,
+                                   max_memory=self.tile_memory, boxsize=boxsize)
+        self.change_velocity(self.boid_velocities)
+
+    def update_boid_velocity_with_kdtree(self,
+                                         check_boundaries: bool,
+                                         horizontal_cyclic_boundary: bool,
+                                         vertical_cyclic_boundary: bool,
+                                         separation_active: bool,
+                                         alignment_active: bool,
+                                         cohesion_active: bool,
+                                         vertical_wall_active: bool,
+                                         horizontal_wall_active: bool):
+        boxsize = self.get_boxsize(check_boundaries, horizontal_cyclic_boundary, vertical_cyclic_boundary)
+        update_boid_velocity_kdtree(self.state.position, self.state.velocity, self.WIDTH, self.HEIGHT,
+                                    separation_active, alignment_active, cohesion_active,
+                                    self.avoid_range, self.avoid_factor,
+                                    self.align_range, self.align_factor,
+                                    self.cohesion_range, self.cohesion_factor,
+                                    horizontal_wall_active, vertical_wall_active,
+                                    self.turn_margin, self.turn_factor, self.boid_velocities,
+                                    boxsize=boxsize)
+        self.change_velocity(self.boid_velocities)
 
     def update_boid_velocity_with_numba(self,
                                         check_boundaries: bool,
@@ -236,94 +501,176 @@ class Flock:
                                         cohesion_active: bool,
                                         vertical_wall_active: bool,
                                         horizontal_wall_active: bool):
-        boid_coordinates = self.convert_boid_to_tuples()
-        boid_velocities = update_boid_velocity_numba(boid_coordinates, self.WIDTH, self.HEIGHT,
-                                                     separation_active, alignment_active, cohesion_active,
-                                                     self.avoid_range, self.avoid_factor,
-                                                     self.align_range, self.align_factor,
-                                                     self.cohesion_range, self.cohesion_factor,
-                                                     horizontal_wall_active, vertical_wall_active,
-                                                     self.turn_margin, self.turn_factor)
-        for boid, velocity in zip(self.boids, boid_velocities):
-            if check_boundaries:
-                boid.check_boundaries(self.WIDTH, self.HEIGHT,
-                                      cyclic_horizontal=horizontal_cyclic_boundary,
-                                      cyclic_vertical=vertical_cyclic_boundary)
-            velocity_vx, velocity_vy = velocity
-            boid.change_velocity(velocity_vx, velocity_vy, self.speed_max, self.speed_min)
-
-    def update_parameters(self, parameters: BoidFlockingParameters):
-        self.boid_scale = parameters.boid
-        self.speed_active = parameters.speed_active
-        self.speed_scale = parameters.speed_scale
-        self.speed_min, self.speed_max = Vec2d(1, parameters.speed_range) * self.speed_scale
-        self.avoid_range = parameters.avoid_range
-        self.avoid_factor = parameters.avoid_factor
-        self.align_range = parameters.align_range
-        self.align_factor = parameters.align_factor
-        self.cohesion_range = parameters.cohesion_range
-        self.cohesion_factor = parameters.cohesion_factor
-        self.turn_margin = parameters.boundary_margin
-        self.turn_factor = parameters.boundary_factor
-
-
-@nb.njit()
-def update_boid_velocity_numba(flock, width, height, separation_active, alignment_active, cohesion_active,
-                               avoid_range, avoid_factor, align_range, align_factor, cohesion_range, cohesion_factor,
-                               horizontal_wall_active, vertical_wall_active, turn_margin, turn_factor):
-    flock_length = len(flock)
-    boid_velocities = []
-    for index in nb.prange(flock_length):
-        boid_vx, boid_vy = flock[index][2], flock[index][3]
-        if separation_active or alignment_active or cohesion_active or horizontal_wall_active or vertical_wall_active:
-            close_dx, close_dy = 0, 0
-            xvel_avg, yvel_avg, neighboring_boids_align = 0, 0, 0
-            xpos_avg, ypos_avg, neighboring_boids_cohesion = 0, 0, 0
-            boid_x, boid_y = flock[index][0], flock[index][1]
-            for other in flock:
-                if other != flock[index]:
-                    boid_distance = np.sqrt(((flock[index][0] - other[0]) ** 2) + ((flock[index][1] - other[1]) ** 2))
-                    other_x, other_y = other[0], other[1]
-                    other_vx, other_vy = other[2], other[3]
-                    if separation_active and boid_distance < avoid_range:
-                        close_dx += boid_x - other_x
-                        close_dy += boid_y - other_y
-                    if alignment_active and boid_distance < align_range:
-                        xvel_avg += other_vx
-                        yvel_avg += other_vy
-                        neighboring_boids_align += 1
-                    if cohesion_active and boid_distance < cohesion_range:
-                        xpos_avg += other_x
-                        ypos_avg += other_y
-                        neighboring_boids_cohesion += 1
-            separation_vx, separation_vy = 0, 0
-            if separation_active:
-                separation_vx = close_dx * avoid_factor
-                separation_vy = close_dy * avoid_factor
-            alignment_vx, alignment_vy = 0, 0
-            if neighboring_boids_align > 0 and alignment_active:
-                alignment_vx = ((xvel_avg / neighboring_boids_align) - boid_vx) * align_factor
-                alignment_vy = ((yvel_avg / neighboring_boids_align) - boid_vy) * align_factor
-            cohesion_vx, cohesion_vy = 0, 0
-            if neighboring_boids_cohesion > 0 and cohesion_active:
-                cohesion_vx = ((xpos_avg / neighboring_boids_cohesion) - boid_x) * cohesion_factor
-                cohesion_vy = ((ypos_avg / neighboring_boids_cohesion) - boid_y) * cohesion_factor
-            wall_vx = 0
-            if horizontal_wall_active:
-                if boid_x < turn_margin:
-                    wall_vx = turn_factor
-                elif boid_x > width - turn_margin:
-                    wall_vx = -turn_factor
-            wall_vy = 0
-            if vertical_wall_active:
-                if boid_y < turn_margin:
-                    wall_vy = turn_factor
-                elif boid_y > height - turn_margin:
-                    wall_vy = -turn_factor
-            boid_vx += separation_vx + alignment_vx + cohesion_vx + wall_vx
-            boid_vy += separation_vy + alignment_vy + cohesion_vy + wall_vy
-        boid_velocities.append((boid_vx, boid_vy))
-    return boid_velocities
+        parameters = self.get_kernel_parameters(check_boundaries=check_boundaries,
+                                                horizontal_cyclic_boundary=horizontal_cyclic_boundary,
+                                                vertical_cyclic_boundary=vertical_cyclic_boundary,
+                                                vertical_wall_active=vertical_wall_active,
+                                                horizontal_wall_active=horizontal_wall_active)
+        kernel = self.get_kernel(update_boid_velocity_numba, (separation_active, alignment_active, cohesion_active))
+        self.run_kernel(kernel, self.state.position, self.state.velocity, parameters, self.boid_velocities)
+        self.change_velocity(self.boid_velocities)
+
+    def update_boid_velocity_with_grid(self,
+                                       check_boundaries: bool,
+                                       horizontal_cyclic_boundary: bool,
+                                       vertical_cyclic_boundary: bool,
+                                       separation_active: bool,
+                                       alignment_active: bool,
+                                       cohesion_active: bool,
+                                       vertical_wall_active: bool,
+                                       horizontal_wall_active: bool):
+        positions, velocities = self.state.position, self.state.velocity
+        parameters = self.get_kernel_parameters(check_boundaries=check_boundaries,
+                                                horizontal_cyclic_boundary=horizontal_cyclic_boundary,
+                                                vertical_cyclic_boundary=vertical_cyclic_boundary,
+                                                vertical_wall_active=vertical_wall_active,
+                                                horizontal_wall_active=horizontal_wall_active)
+        cell_start, cell_boids = self.run_kernel(build_cell_list, positions, parameters)
+        self.mark_phase('neighbors')
+        kernel = self.get_kernel(update_boid_velocity_grid_numba,
+                                 (separation_active, alignment_active, cohesion_active))
+        self.run_kernel(kernel, positions, velocities, cell_start, cell_boids, parameters, self.boid_velocities)
+        self.change_velocity(self.boid_velocities)
+
+    def update_boid_velocity_with_verlet(self,
+                                         check_boundaries: bool,
+                                         horizontal_cyclic_boundary: bool,
+                                         vertical_cyclic_boundary: bool,
+                                         separation_active: bool,
+                                         alignment_active: bool,
+                                         cohesion_active: bool,
+                                         vertical_wall_active: bool,
+                                         horizontal_wall_active: bool):
+        positions, velocities = self.state.position, self.state.velocity
+        parameters = self.get_kernel_parameters(check_boundaries=check_boundaries,
+                                                horizontal_cyclic_boundary=horizontal_cyclic_boundary,
+                                                vertical_cyclic_boundary=vertical_cyclic_boundary,
+                                                vertical_wall_active=vertical_wall_active,
+                                                horizontal_wall_active=horizontal_wall_active)
+        neighbor_start, neighbor_boids = self.update_neighbor_list(
+            parameters, (separation_active, alignment_active, cohesion_active))
+        self.mark_phase('neighbors')
+        kernel = self.get_kernel(update_boid_velocity_verlet_numba,
+                                 (separation_active, alignment_active, cohesion_active))
+        self.run_kernel(kernel, positions, velocities, neighbor_start, neighbor_boids, parameters,
+                        self.boid_velocities)
+        self.change_velocity(self.boid_velocities)
+
+    def update_neighbor_list(self, parameters: np.ndarray, pair_rules: tuple[bool, bool, bool]):
+        # the list holds every pair closer than the largest active rule range plus the skin, until some boid has
+        # moved half the skin no two boids can have come from outside the list into a rule range
+        positions = self.state.position
+        record = parameters[0]
+        skin = self.get_verlet_skin(record['dt'])
+        rule_ranges = [rule_range for rule_range, active in zip(
+            (self.avoid_range, self.align_range, self.cohesion_range), pair_rules) if active]
+        # pairs across a cyclic edge are only in lists built for that edge
+        list_key = (float(max(rule_ranges, default=0) + skin),
+                    bool(record['check_boundaries'] and record['horizontal_cyclic_boundary']),
+                    bool(record['check_boundaries'] and record['vertical_cyclic_boundary']))
+        if (self.neighbor_list is None or self.neighbor_list_key != list_key
+                or self.neighbor_list_positions.shape != positions.shape
+                or get_max_squared_displacement(positions, self.neighbor_list_positions, parameters)
+                > (skin / 2) ** 2):
+            self.neighbor_list = self.run_kernel(self.get_kernel(build_neighbor_list), positions, parameters,
+                                                 max(list_key[0], 1.0))
+            self.neighbor_list_positions = positions.copy()
+            self.neighbor_list_key = list_key
+            self.neighbor_list_builds += 1
+        self.neighbor_list_frames += 1
+        return self.neighbor_list
+
+    def get_verlet_skin(self, dt: float):
+        # boids close in on each other by at most 2 * speed_max * dt per step, a longer lasting list holds more
+        # pairs that every step goes through
+        if self.verlet_skin is not None:
+            return self.verlet_skin
+        return self.verlet_skin_steps * 2 * self.speed_max * dt
+
+    def get_neighbor_list_stats(self):
+        memory, pairs = 0, 0
+        if self.neighbor_list is not None:
+            neighbor_start, neighbor_boids = self.neighbor_list
+            memory = neighbor_start.nbytes + neighbor_boids.nbytes + self.neighbor_list_positions.nbytes
+            pairs = neighbor_boids.shape[0]
+        return {
+            'builds': self.neighbor_list_builds,
+            'frames': self.neighbor_list_frames,
+            'rebuild_rate': self.neighbor_list_builds / max(self.neighbor_list_frames, 1),
+            'pairs': pairs,
+            'memory': memory,
+        }
+
+    def get_kernel(self, kernel, pair_rules: tuple[bool, bool, bool] = (True, True, True)):
+        # numba thread count is thread local, so it is set right before every parallel call
+        if self.parallel:
+            nb.set_num_threads(self.threads)
+        return compile_kernel(kernel, self.parallel, self.fastmath, pair_rules)
+
+    def run_kernel(self, kernel, *args):
+        signatures = len(getattr(kernel, 'signatures', ()))
+        result = kernel(*args)
+        # after the warm up every kernel signature should be compiled, a new one means a mid simulation hitch
+        if len(getattr(kernel, 'signatures', ())) > signatures and self.compile_time is not None and any(
+                (kernel, signature) not in self.variant_signatures for signature in kernel.signatures[signatures:]):
+            self.recompilations += 1
+            print(f'{kernel.__name__} recompiled, {self.recompilations} recompilations since warm up')
+        return result
+
+    def get_kernel_parameters(self, dt: float = 0, **rules: bool):
+        # the kernels take the one record array rather than the record, numba cannot hand a record by value
+        # to the threads of a parallel loop
+        parameters = self.kernel_parameters[0]
+        # flock fields are only written after set_parameters, the rules and dt of the step every time
+        if self.parameters_changed:
+            columns, rows = self.get_grid_shape()
+            parameters['width'], parameters['height'] = self.WIDTH, self.HEIGHT
+            parameters['columns'], parameters['rows'] = columns, rows
+            parameters['cell_size'] = self.cell_size
+            parameters['avoid_range'], parameters['avoid_factor'] = self.avoid_range, self.avoid_factor
+            parameters['align_range'], parameters['align_factor'] = self.align_range, self.align_factor
+            parameters['cohesion_range'], parameters['cohesion_factor'] = self.cohesion_range, self.cohesion_factor
+            parameters['turn_margin'], parameters['turn_factor'] = self.turn_margin, self.turn_factor
+            parameters['speed_min'], parameters['speed_max'] = self.speed_min, self.speed_max
+            self.parameters_changed = False
+        parameters['dt'] = dt
+        for name, value in rules.items():
+            parameters[name] = value
+        return self.kernel_parameters
+
+    def get_speed_bounds(self):
+        return float(self.speed_range[0] * self.speed_scale), float(self.speed_range[1] * self.speed_scale)
+
+    def get_cell_size(self):
+        return max(self.avoid_range, self.align_range, self.cohesion_range, 1)
+
+    def get_grid_shape(self):
+        # cells are never smaller than the largest rule range, so 3x3 cells cover every neighbor
+        columns = max(1, int(self.WIDTH // self.cell_size))
+        rows = max(1, int(self.HEIGHT // self.cell_size))
+        return columns, rows
+
+    def set_parameters(self, changes: dict):
+        # changes maps BoidFlockingParameters fields to new values, only the data derived from them is recomputed,
+        # flock parameters changed any other way need parameters_changed set to reach the kernels
+        for field, value in changes.items():
+            if field in self.parameter_fields:
+                setattr(self, self.parameter_fields[field], value)
+        if 'speed_range' in changes:
+            self.speed_range = (self.speed_range[0], changes['speed_range'])
+        if 'speed_range' in changes or 'speed_scale' in changes:
+            self.speed_min, self.speed_max = self.get_speed_bounds()
+        if 'avoid_range' in changes or 'align_range' in changes or 'cohesion_range' in changes:
+            self.cell_size = self.get_cell_size()
+        if 'speed_active' in changes and changes['speed_active'] != self.speed_active:
+            if changes['speed_active']:
+                self.accelerate_boids()
+            else:
+                self.stop_boids()
+        self.parameters_changed = True
+
+    def update_parameters(self, parameters: 'BoidFlockingParameters'):
+        self.set_parameters(dataclasses.asdict(parameters))
 
 
 if __name__ == '__main__':
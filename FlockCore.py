@@ -0,0 +1,646 @@
+import types
+import warnings
+import numpy as np
+try:
+    import numba as nb
+    from numba.core.errors import NumbaPendingDeprecationWarning
+    warnings.simplefilter('ignore', category=NumbaPendingDeprecationWarning)
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    class nb:
+        # without numba the kernels below run as plain python functions
+        prange = range
+
+        @staticmethod
+        def njit(*args, **kwargs):
+            return lambda function: function
+
+
+class FlockState:
+    def __init__(self, number_of_boids: int, dtype: type = np.float64):
+        # float32 state halves the memory the neighbor loops stream through, the kernels still sum neighbors
+        # and integrate in float64 and only round when they store
+        self.number_of_boids = number_of_boids
+        self.dtype = np.dtype(dtype)
+        self.position = np.zeros((number_of_boids, 2), dtype=self.dtype)
+        self.velocity = np.zeros((number_of_boids, 2), dtype=self.dtype)
+        self.angle = np.zeros(number_of_boids, dtype=self.dtype)
+        self.speed = np.zeros(number_of_boids, dtype=self.dtype)
+        self.color = np.zeros((number_of_boids, 4), dtype=np.uint8)
+        # back buffers written by the fused step kernel
+        self.next_position = np.zeros((number_of_boids, 2), dtype=self.dtype)
+        self.next_velocity = np.zeros((number_of_boids, 2), dtype=self.dtype)
+
+    def swap(self):
+        self.position, self.next_position = self.next_position, self.position
+        self.velocity, self.next_velocity = self.next_velocity, self.velocity
+
+    def get_memory(self):
+        return sum(array.nbytes for array in (self.position, self.velocity, self.angle, self.speed, self.color,
+                                              self.next_position, self.next_velocity))
+
+# every value the numba kernels read besides the flock arrays, with one fixed type per field, so slider values
+# that arrive as ints or floats always reach the kernels as the same record type and never trigger a recompile
+KERNEL_PARAMETERS = np.dtype([
+    ('width', np.float64),
+    ('height', np.float64),
+    ('columns', np.int64),
+    ('rows', np.int64),
+    ('cell_size', np.float64),
+    ('check_boundaries', np.bool_),
+    ('horizontal_cyclic_boundary', np.bool_),
+    ('vertical_cyclic_boundary', np.bool_),
+    ('vertical_wall_active', np.bool_),
+    ('horizontal_wall_active', np.bool_),
+    ('avoid_range', np.float64),
+    ('avoid_factor', np.float64),
+    ('align_range', np.float64),
+    ('align_factor', np.float64),
+    ('cohesion_range', np.float64),
+    ('cohesion_factor', np.float64),
+    ('turn_margin', np.float64),
+    ('turn_factor', np.float64),
+    ('speed_min', np.float64),
+    ('speed_max', np.float64),
+    ('dt', np.float64),
+], align=True)
+
+
+def update_boid_velocity_numpy(positions, velocities, width, height,
+                               separation_active, alignment_active, cohesion_active,
+                               avoid_range, avoid_factor, align_range, align_factor, cohesion_range, cohesion_factor,
+                               horizontal_wall_active, vertical_wall_active, turn_margin, turn_factor,
+                               boid_velocities, max_memory: int = 256 * 2 ** 20,
+                               boxsize: tuple[float, float] = (0, 0)):
+    flock_length = positions.shape[0]
+    boid_velocities[:] = velocities
+    if flock_length == 0:
+        return
+    if separation_active or alignment_active or cohesion_active:
+        # about ten float64 (tile, flock_length) temporaries are alive at once
+        tile = int(min(max(max_memory // (10 * 8 * flock_length), 1), flock_length))
+        for start in range(0, flock_length, tile):
+            stop = min(start + tile, flock_length)
+            boid_positions = positions[start:stop]
+            dx = boid_positions[:, 0, np.newaxis] - positions[np.newaxis, :, 0]
+            dy = boid_positions[:, 1, np.newaxis] - positions[np.newaxis, :, 1]
+            # minimum image displacement on a cyclic axis, zero boxsize leaves the axis non periodic
+            if boxsize[0] > 0:
+                dx -= boxsize[0] * np.rint(dx / boxsize[0])
+            if boxsize[1] > 0:
+                dy -= boxsize[1] * np.rint(dy / boxsize[1])
+            squared_distance = dx * dx + dy * dy
+            tile_index = np.arange(stop - start)
+            squared_distance[tile_index, tile_index + start] = np.inf
+            if separation_active:
+                neighbors = (squared_distance < avoid_range ** 2).astype(np.float64)
+                boid_velocities[start:stop, 0] += np.einsum('ij,ij->i', neighbors, dx) * avoid_factor
+                boid_velocities[start:stop, 1] += np.einsum('ij,ij->i', neighbors, dy) * avoid_factor
+            if alignment_active:
+                neighbors = (squared_distance < align_range ** 2).astype(np.float64)
+                neighbor_count = neighbors.sum(axis=1)
+                has_neighbors = neighbor_count > 0
+                velocity_avg = (neighbors @ velocities)[has_neighbors] / neighbor_count[has_neighbors, np.newaxis]
+                boid_velocities[start:stop][has_neighbors] += \
+                    (velocity_avg - velocities[start:stop][has_neighbors]) * align_factor
+            if cohesion_active:
+                neighbors = (squared_distance < cohesion_range ** 2).astype(np.float64)
+                neighbor_count = neighbors.sum(axis=1)
+                has_neighbors = neighbor_count > 0
+                # the centroid of the neighbor images lies the mean displacement away from the boid
+                displacement = np.stack((np.einsum('ij,ij->i', neighbors, dx),
+                                         np.einsum('ij,ij->i', neighbors, dy)), axis=1)
+                boid_velocities[start:stop][has_neighbors] -= \
+                    displacement[has_neighbors] / neighbor_count[has_neighbors, np.newaxis] * cohesion_factor
+    if horizontal_wall_active:
+        boid_velocities[positions[:, 0] < turn_margin, 0] += turn_factor
+        boid_velocities[positions[:, 0] > width - turn_margin, 0] -= turn_factor
+    if vertical_wall_active:
+        boid_velocities[positions[:, 1] < turn_margin, 1] += turn_factor
+        boid_velocities[positions[:, 1] > height - turn_margin, 1] -= turn_factor
+
+
+def update_boid_velocity_kdtree(positions, velocities, width, height,
+                                separation_active, alignment_active, cohesion_active,
+                                avoid_range, avoid_factor, align_range, align_factor, cohesion_range, cohesion_factor,
+                                horizontal_wall_active, vertical_wall_active, turn_margin, turn_factor,
+                                boid_velocities, boxsize: tuple[float, float] = (0, 0)):
+    from scipy.spatial import cKDTree
+    boid_velocities[:] = velocities
+    rule_ranges = [rule_range for rule_range, active in ((avoid_range, separation_active),
+                                                         (align_range, alignment_active),
+                                                         (cohesion_range, cohesion_active)) if active]
+    if rule_ranges and positions.shape[0] > 1:
+        boxsize = np.asarray(boxsize, dtype=np.float64)
+        periodic = boxsize > 0
+        tree_positions = positions.copy()
+        tree_positions[:, periodic] %= boxsize[periodic]
+        tree = cKDTree(tree_positions, boxsize=boxsize if periodic.any() else None)
+        pairs = tree.sparse_distance_matrix(tree, max(rule_ranges), output_type='ndarray')
+        pairs = pairs[pairs['i'] != pairs['j']]
+        pairs = pairs[np.argsort(pairs['i'], kind='stable')]
+        boid_index, other_index = pairs['i'], pairs['j']
+        # minimum image displacement, so neighbors across a cyclic edge pull the right way
+        displacement = tree_positions[boid_index] - tree_positions[other_index]
+        displacement[:, periodic] -= boxsize[periodic] * np.round(displacement[:, periodic] / boxsize[periodic])
+        squared_distance = np.einsum('ij,ij->i', displacement, displacement)
+
+        def sum_neighbors(rule_range, values):
+            in_range = squared_distance < rule_range ** 2
+            boids, starts = np.unique(boid_index[in_range], return_index=True)
+            if boids.size == 0:
+                return boids, values[:0], boids
+            counts = np.diff(np.append(starts, np.count_nonzero(in_range)))
+            return boids, np.add.reduceat(values[in_range], starts, axis=0), counts
+
+        if separation_active:
+            boids, close, _ = sum_neighbors(avoid_range, displacement)
+            boid_velocities[boids] += close * avoid_factor
+        if alignment_active:
+            boids, velocity_sum, counts = sum_neighbors(align_range, velocities[other_index])
+            boid_velocities[boids] += (velocity_sum / counts[:, np.newaxis] - velocities[boids]) * align_factor
+        if cohesion_active:
+            # the neighbor centroid relative to the boid is minus the mean displacement
+            boids, displacement_sum, counts = sum_neighbors(cohesion_range, displacement)
+            boid_velocities[boids] -= displacement_sum / counts[:, np.newaxis] * cohesion_factor
+    if horizontal_wall_active:
+        boid_velocities[positions[:, 0] < turn_margin, 0] += turn_factor
+        boid_velocities[positions[:, 0] > width - turn_margin, 0] -= turn_factor
+    if vertical_wall_active:
+        boid_velocities[positions[:, 1] < turn_margin, 1] += turn_factor
+        boid_velocities[positions[:, 1] > height - turn_margin, 1] -= turn_factor
+
+
+# the pair rules the kernels are compiled for, numba reads globals as constants, so the variants compile_kernel
+# builds with other values drop the branches of every disabled rule from the neighbor loop
+SEPARATION_ACTIVE = ALIGNMENT_ACTIVE = COHESION_ACTIVE = True
+PAIR_RULES = ('SEPARATION_ACTIVE', 'ALIGNMENT_ACTIVE', 'COHESION_ACTIVE')
+
+compiled_kernels = {}
+
+
+def compile_kernel(kernel, parallel: bool = False, fastmath: bool = False,
+                   pair_rules: tuple[bool, bool, bool] = (True, True, True)):
+    # serial kernels with every pair rule are used as they are, other variants are compiled once from the same
+    # python source
+    pair_rules = tuple(bool(rule) for rule in pair_rules)
+    if not parallel and not fastmath and all(pair_rules):
+        return kernel
+    function = getattr(kernel, 'py_func', kernel)
+    key = (function, parallel, fastmath, pair_rules)
+    if key not in compiled_kernels:
+        # the numba cache tells functions apart by qualified name only, every variant needs its own
+        variant_globals = function.__globals__
+        rules_name = ''
+        if not all(pair_rules):
+            variant_globals = {**function.__globals__, **dict(zip(PAIR_RULES, pair_rules))}
+            rules_name = '_rules' + ''.join(str(int(rule)) for rule in pair_rules)
+        variant = types.FunctionType(function.__code__, variant_globals, function.__name__,
+                                     function.__defaults__, function.__closure__)
+        variant.__qualname__ = f"{function.__qualname__}{'_parallel' * parallel}{'_fastmath' * fastmath}{rules_name}"
+        compiled_kernels[key] = nb.njit(parallel=parallel, fastmath=fastmath, nogil=True, cache=True)(variant)
+    return compiled_kernels[key]
+
+
+@nb.njit(nogil=True, cache=True)
+def update_boid_velocity_numba(positions, velocities, parameters, boid_velocities):
+    separation_active, alignment_active, cohesion_active = SEPARATION_ACTIVE, ALIGNMENT_ACTIVE, COHESION_ACTIVE
+    real = positions.dtype.type
+    avoid_squared, align_squared, cohesion_squared, max_squared = get_rule_ranges(
+        parameters, real, separation_active, alignment_active, cohesion_active)
+    width, height = real(parameters[0]['width']), real(parameters[0]['height'])
+    cyclic_x, cyclic_y = get_cyclic_axes(parameters)
+    flock_length = positions.shape[0]
+    for index in nb.prange(flock_length):
+        boid_x, boid_y = positions[index, 0], positions[index, 1]
+        close_dx, close_dy = 0.0, 0.0
+        xvel_avg, yvel_avg, neighboring_boids_align = 0.0, 0.0, 0
+        xpos_avg, ypos_avg, neighboring_boids_cohesion = 0.0, 0.0, 0
+        if separation_active or alignment_active or cohesion_active:
+            for other in range(flock_length):
+                other_x = get_nearest_image(positions[other, 0], boid_x, width, cyclic_x)
+                other_y = get_nearest_image(positions[other, 1], boid_y, height, cyclic_y)
+                dx, dy = boid_x - other_x, boid_y - other_y
+                squared_distance = dx * dx + dy * dy
+                if squared_distance >= max_squared or other == index:
+                    continue
+                if separation_active and squared_distance < avoid_squared:
+                    close_dx += dx
+                    close_dy += dy
+                if alignment_active and squared_distance < align_squared:
+                    xvel_avg += velocities[other, 0]
+                    yvel_avg += velocities[other, 1]
+                    neighboring_boids_align += 1
+                if cohesion_active and squared_distance < cohesion_squared:
+                    xpos_avg += other_x
+                    ypos_avg += other_y
+                    neighboring_boids_cohesion += 1
+        boid_vx, boid_vy = combine_rules(boid_x, boid_y, velocities[index, 0], velocities[index, 1], parameters,
+                                         separation_active, alignment_active, cohesion_active,
+                                         close_dx, close_dy, xvel_avg, yvel_avg, neighboring_boids_align,
+                                         xpos_avg, ypos_avg, neighboring_boids_cohesion)
+        boid_velocities[index, 0] = boid_vx
+        boid_velocities[index, 1] = boid_vy
+
+
+@nb.njit(nogil=True, cache=True)
+def build_cell_list(positions, parameters):
+    return sort_into_cells(positions, parameters[0]['width'], parameters[0]['height'],
+                           parameters[0]['columns'], parameters[0]['rows'])
+
+
+@nb.njit(nogil=True, cache=True)
+def sort_into_cells(positions, width, height, columns, rows):
+    # counting sort of boid indices by cell, boids of cell c are cell_boids[cell_start[c]:cell_start[c + 1]]
+    flock_length = positions.shape[0]
+    boid_cells = np.empty(flock_length, dtype=np.int64)
+    cell_start = np.zeros(columns * rows + 1, dtype=np.int64)
+    for index in range(flock_length):
+        cell = get_cell_index(positions[index, 0], positions[index, 1], width, height, columns, rows)
+        boid_cells[index] = cell
+        cell_start[cell + 1] += 1
+    for cell in range(columns * rows):
+        cell_start[cell + 1] += cell_start[cell]
+    cell_fill = cell_start[:-1].copy()
+    cell_boids = np.empty(flock_length, dtype=np.int64)
+    for index in range(flock_length):
+        cell = boid_cells[index]
+        cell_boids[cell_fill[cell]] = index
+        cell_fill[cell] += 1
+    return cell_start, cell_boids
+
+
+@nb.njit(nogil=True, cache=True)
+def get_cell_index(x, y, width, height, columns, rows):
+    # boids outside of the window are kept in the border cells
+    column = min(max(int(x * columns / width), 0), columns - 1)
+    row = min(max(int(y * rows / height), 0), rows - 1)
+    return row * columns + column
+
+
+@nb.njit(inline='always')
+def get_rule_ranges(parameters, real, separation_active, alignment_active, cohesion_active):
+    # squared ranges are compared with squared distances, no square root per pair, and the one compare with
+    # the largest active range rejects most pairs before any rule is looked at, distances are computed in
+    # real, the dtype of the positions, so a float32 flock never converts a pair to float64
+    record = parameters[0]
+    max_range = 0.0
+    if separation_active:
+        max_range = max(max_range, record['avoid_range'])
+    if alignment_active:
+        max_range = max(max_range, record['align_range'])
+    if cohesion_active:
+        max_range = max(max_range, record['cohesion_range'])
+    return (real(record['avoid_range'] ** 2), real(record['align_range'] ** 2), real(record['cohesion_range'] ** 2),
+            real(max_range ** 2))
+
+
+@nb.njit(inline='always')
+def get_cyclic_axes(parameters):
+    record = parameters[0]
+    return (record['check_boundaries'] and record['horizontal_cyclic_boundary'],
+            record['check_boundaries'] and record['vertical_cyclic_boundary'])
+
+
+@nb.njit(inline='always')
+def get_nearest_image(coordinate, origin, limit, cyclic):
+    # on a cyclic axis the copy of coordinate closest to origin, boids across the seam are neighbors this way
+    # without ghost copies of them, rounding keeps the neighbor loops free of branches that stop vectorization
+    if cyclic:
+        return coordinate - limit * np.rint((coordinate - origin) / limit)
+    return coordinate
+
+
+@nb.njit(inline='always')
+def get_cell_span(cell, cells, reach, cyclic):
+    # first cell and number of cells within reach along one axis, and whether pairs take their nearest image,
+    # on a cyclic axis the span runs past the edges, cell u of the span is cell u % cells shifted by u // cells
+    # world lengths, so all boids of a cell share one image, a span longer than the axis would visit cells twice
+    # and find boids through two images, so every cell is visited once and each pair takes its nearest image
+    if cyclic and 2 * reach + 1 > cells:
+        return 0, cells, True
+    if cyclic:
+        return cell - reach, 2 * reach + 1, False
+    first = max(cell - reach, 0)
+    return first, min(cell + reach + 1, cells) - first, False
+
+
+@nb.njit(inline='always')
+def combine_rules(boid_x, boid_y, boid_vx, boid_vy, parameters, separation_active, alignment_active,
+                  cohesion_active, close_dx, close_dy, xvel_avg, yvel_avg, neighboring_boids_align,
+                  xpos_avg, ypos_avg, neighboring_boids_cohesion):
+    record = parameters[0]
+    width, height = record['width'], record['height']
+    turn_margin, turn_factor = record['turn_margin'], record['turn_factor']
+    separation_vx, separation_vy = 0.0, 0.0
+    if separation_active:
+        separation_vx = close_dx * record['avoid_factor']
+        separation_vy = close_dy * record['avoid_factor']
+    alignment_vx, alignment_vy = 0.0, 0.0
+    if alignment_active and neighboring_boids_align > 0:
+        alignment_vx = ((xvel_avg / neighboring_boids_align) - boid_vx) * record['align_factor']
+        alignment_vy = ((yvel_avg / neighboring_boids_align) - boid_vy) * record['align_factor']
+    cohesion_vx, cohesion_vy = 0.0, 0.0
+    if cohesion_active and neighboring_boids_cohesion > 0:
+        cohesion_vx = ((xpos_avg / neighboring_boids_cohesion) - boid_x) * record['cohesion_factor']
+        cohesion_vy = ((ypos_avg / neighboring_boids_cohesion) - boid_y) * record['cohesion_factor']
+    wall_vx = 0.0
+    if record['horizontal_wall_active']:
+        if boid_x < turn_margin:
+            wall_vx = turn_factor
+        elif boid_x > width - turn_margin:
+            wall_vx = -turn_factor
+    wall_vy = 0.0
+    if record['vertical_wall_active']:
+        if boid_y < turn_margin:
+            wall_vy = turn_factor
+        elif boid_y > height - turn_margin:
+            wall_vy = -turn_factor
+    return (boid_vx + (separation_vx + alignment_vx + cohesion_vx + wall_vx),
+            boid_vy + (separation_vy + alignment_vy + cohesion_vy + wall_vy))
+
+
+@nb.njit(inline='always')
+def steer_boid_grid(index, positions, velocities, cell_start, cell_boids, parameters,
+                    separation_active, alignment_active, cohesion_active):
+    record = parameters[0]
+    width, height = record['width'], record['height']
+    columns, rows = record['columns'], record['rows']
+    real = positions.dtype.type
+    avoid_squared, align_squared, cohesion_squared, max_squared = get_rule_ranges(
+        parameters, real, separation_active, alignment_active, cohesion_active)
+    cyclic_x, cyclic_y = get_cyclic_axes(parameters)
+    boid_x, boid_y = positions[index, 0], positions[index, 1]
+    close_dx, close_dy = 0.0, 0.0
+    xvel_avg, yvel_avg, neighboring_boids_align = 0.0, 0.0, 0
+    xpos_avg, ypos_avg, neighboring_boids_cohesion = 0.0, 0.0, 0
+    if separation_active or alignment_active or cohesion_active:
+        cell = get_cell_index(boid_x, boid_y, width, height, columns, rows)
+        first_row, row_count, image_y = get_cell_span(cell // columns, rows, 1, cyclic_y)
+        first_column, column_count, image_x = get_cell_span(cell % columns, columns, 1, cyclic_x)
+        for row in range(first_row, first_row + row_count):
+            shift_y = real((row // rows) * height)
+            for column in range(first_column, first_column + column_count):
+                shift_x = real((column // columns) * width)
+                neighbor_cell = (row % rows) * columns + column % columns
+                for position in range(cell_start[neighbor_cell], cell_start[neighbor_cell + 1]):
+                    other = cell_boids[position]
+                    other_x = get_nearest_image(positions[other, 0] + shift_x, boid_x, real(width), image_x)
+                    other_y = get_nearest_image(positions[other, 1] + shift_y, boid_y, real(height), image_y)
+                    dx, dy = boid_x - other_x, boid_y - other_y
+                    squared_distance = dx * dx + dy * dy
+                    if squared_distance >= max_squared or other == index:
+                        continue
+                    if separation_active and squared_distance < avoid_squared:
+                        close_dx += dx
+                        close_dy += dy
+                    if alignment_active and squared_distance < align_squared:
+                        xvel_avg += velocities[other, 0]
+                        yvel_avg += velocities[other, 1]
+                        neighboring_boids_align += 1
+                    if cohesion_active and squared_distance < cohesion_squared:
+                        xpos_avg += other_x
+                        ypos_avg += other_y
+                        neighboring_boids_cohesion += 1
+    return combine_rules(boid_x, boid_y, velocities[index, 0], velocities[index, 1], parameters,
+                         separation_active, alignment_active, cohesion_active,
+                         close_dx, close_dy, xvel_avg, yvel_avg, neighboring_boids_align,
+                         xpos_avg, ypos_avg, neighboring_boids_cohesion)
+
+
+@nb.njit(nogil=True, cache=True)
+def update_boid_velocity_grid_numba(positions, velocities, cell_start, cell_boids, parameters, boid_velocities):
+    separation_active, alignment_active, cohesion_active = SEPARATION_ACTIVE, ALIGNMENT_ACTIVE, COHESION_ACTIVE
+    flock_length = positions.shape[0]
+    for index in nb.prange(flock_length):
+        boid_vx, boid_vy = steer_boid_grid(index, positions, velocities, cell_start, cell_boids, parameters,
+                                           separation_active, alignment_active, cohesion_active)
+        boid_velocities[index, 0] = boid_vx
+        boid_velocities[index, 1] = boid_vy
+
+
+@nb.njit(nogil=True, cache=True)
+def step_flock_grid_numba(positions, velocities, cell_start, cell_boids, parameters,
+                          boid_indices, next_positions, next_velocities, angles, speeds):
+    # steering, speed clamp, heading, integration and boundaries of one frame, read from the current
+    # position and velocity buffers and written to the next ones, row k of the outputs is boid_indices[k]
+    separation_active, alignment_active, cohesion_active = SEPARATION_ACTIVE, ALIGNMENT_ACTIVE, COHESION_ACTIVE
+    for output in nb.prange(boid_indices.shape[0]):
+        index = boid_indices[output]
+        boid_vx, boid_vy = steer_boid_grid(index, positions, velocities, cell_start, cell_boids, parameters,
+                                           separation_active, alignment_active, cohesion_active)
+        integrate_boid(index, output, boid_vx, boid_vy, positions, parameters,
+                       next_positions, next_velocities, angles, speeds)
+
+
+@nb.njit(nogil=True, cache=True)
+def build_neighbor_list(positions, parameters, list_range):
+    # compressed rows of every pair closer than list_range, the candidates of boid i are
+    # neighbor_boids[neighbor_start[i]:neighbor_start[i + 1]], found through cells of the list range
+    width, height = parameters[0]['width'], parameters[0]['height']
+    # cells of half the list range, the 5x5 cells around a boid cover less area than 3x3 cells of the full range
+    columns = max(1, int(2 * width // list_range))
+    rows = max(1, int(2 * height // list_range))
+    cell_start, cell_boids = sort_into_cells(positions, width, height, columns, rows)
+    cyclic_x, cyclic_y = get_cyclic_axes(parameters)
+    list_squared = positions.dtype.type(list_range ** 2)
+    flock_length = positions.shape[0]
+    # a row holds at most the boids of its 5x5 cells, so the rows are filled with a single pass of distances
+    # into slots of that size and compacted after, instead of measuring every distance twice to count them
+    slot_start = np.zeros(flock_length + 1, dtype=np.int64)
+    for index in nb.prange(flock_length):
+        slot_start[index + 1] = count_cell_boids(index, positions, cell_start, columns, rows, width, height,
+                                                 cyclic_x, cyclic_y)
+    for index in range(flock_length):
+        slot_start[index + 1] += slot_start[index]
+    slots = np.empty(slot_start[flock_length], dtype=np.int32)
+    neighbor_start = np.zeros(flock_length + 1, dtype=np.int64)
+    for index in nb.prange(flock_length):
+        neighbor_start[index + 1] = visit_cell_neighbors(index, positions, cell_start, cell_boids, columns, rows,
+                                                        width, height, cyclic_x, cyclic_y, list_squared,
+                                                        slots[slot_start[index]:slot_start[index + 1]])
+    for index in range(flock_length):
+        neighbor_start[index + 1] += neighbor_start[index]
+    neighbor_boids = np.empty(neighbor_start[flock_length], dtype=np.int32)
+    for index in nb.prange(flock_length):
+        count = neighbor_start[index + 1] - neighbor_start[index]
+        neighbor_boids[neighbor_start[index]:neighbor_start[index + 1]] = \
+            slots[slot_start[index]:slot_start[index] + count]
+    return neighbor_start, neighbor_boids
+
+
+@nb.njit(inline='always')
+def count_cell_boids(index, positions, cell_start, columns, rows, width, height, cyclic_x, cyclic_y):
+    cell = get_cell_index(positions[index, 0], positions[index, 1], width, height, columns, rows)
+    first_row, row_count, image_y = get_cell_span(cell // columns, rows, 2, cyclic_y)
+    first_column, column_count, image_x = get_cell_span(cell % columns, columns, 2, cyclic_x)
+    count = 0
+    for row in range(first_row, first_row + row_count):
+        for column in range(first_column, first_column + column_count):
+            neighbor_cell = (row % rows) * columns + column % columns
+            count += cell_start[neighbor_cell + 1] - cell_start[neighbor_cell]
+    return count
+
+
+@nb.njit(inline='always')
+def visit_cell_neighbors(index, positions, cell_start, cell_boids, columns, rows, width, height,
+                         cyclic_x, cyclic_y, list_squared, neighbors):
+    # writes the boids closer than the list range to neighbors and returns their count
+    boid_x, boid_y = positions[index, 0], positions[index, 1]
+    cell = get_cell_index(boid_x, boid_y, width, height, columns, rows)
+    first_row, row_count, image_y = get_cell_span(cell // columns, rows, 2, cyclic_y)
+    first_column, column_count, image_x = get_cell_span(cell % columns, columns, 2, cyclic_x)
+    real = positions.dtype.type
+    count = 0
+    for row in range(first_row, first_row + row_count):
+        shift_y = real((row // rows) * height)
+        for column in range(first_column, first_column + column_count):
+            shift_x = real((column // columns) * width)
+            neighbor_cell = (row % rows) * columns + column % columns
+            for position in range(cell_start[neighbor_cell], cell_start[neighbor_cell + 1]):
+                other = cell_boids[position]
+                dx = boid_x - get_nearest_image(positions[other, 0] + shift_x, boid_x, real(width), image_x)
+                dy = boid_y - get_nearest_image(positions[other, 1] + shift_y, boid_y, real(height), image_y)
+                # neighbors has a slot for every boid of the cells, so each one is written and only kept by the
+                # count, about half of them are in range and a branch on it would be mispredicted as often
+                neighbors[count] = other
+                count += (dx * dx + dy * dy < list_squared) & (other != index)
+    return count
+
+
+@nb.njit(nogil=True, cache=True)
+def get_max_squared_displacement(positions, list_positions, parameters):
+    # a boid that wrapped around a cyclic edge has only moved as far as its nearest image
+    width, height = parameters[0]['width'], parameters[0]['height']
+    cyclic_x, cyclic_y = get_cyclic_axes(parameters)
+    max_squared = 0.0
+    for index in range(positions.shape[0]):
+        dx = positions[index, 0] - get_nearest_image(list_positions[index, 0], positions[index, 0], width, cyclic_x)
+        dy = positions[index, 1] - get_nearest_image(list_positions[index, 1], positions[index, 1], height, cyclic_y)
+        max_squared = max(max_squared, dx * dx + dy * dy)
+    return max_squared
+
+
+@nb.njit(inline='always')
+def steer_boid_verlet(index, positions, velocities, neighbor_start, neighbor_boids, parameters,
+                      separation_active, alignment_active, cohesion_active):
+    real = positions.dtype.type
+    avoid_squared, align_squared, cohesion_squared, max_squared = get_rule_ranges(
+        parameters, real, separation_active, alignment_active, cohesion_active)
+    width, height = real(parameters[0]['width']), real(parameters[0]['height'])
+    cyclic_x, cyclic_y = get_cyclic_axes(parameters)
+    boid_x, boid_y = positions[index, 0], positions[index, 1]
+    # a list also holds pairs beyond the rule ranges, only a boid within the largest range of a cyclic edge has
+    # neighbors in range across it, every other boid skips the nearest image of its neighbors
+    max_range = np.sqrt(max_squared)
+    cyclic_x = cyclic_x and (boid_x < max_range or boid_x > width - max_range)
+    cyclic_y = cyclic_y and (boid_y < max_range or boid_y > height - max_range)
+    close_dx, close_dy = 0.0, 0.0
+    xvel_avg, yvel_avg, neighboring_boids_align = 0.0, 0.0, 0
+    xpos_avg, ypos_avg, neighboring_boids_cohesion = 0.0, 0.0, 0
+    if separation_active or alignment_active or cohesion_active:
+        for position in range(neighbor_start[index], neighbor_start[index + 1]):
+            other = neighbor_boids[position]
+            other_x = get_nearest_image(positions[other, 0], boid_x, width, cyclic_x)
+            other_y = get_nearest_image(positions[other, 1], boid_y, height, cyclic_y)
+            dx, dy = boid_x - other_x, boid_y - other_y
+            squared_distance = dx * dx + dy * dy
+            if squared_distance >= max_squared:
+                continue
+            if separation_active and squared_distance < avoid_squared:
+                close_dx += dx
+                close_dy += dy
+            if alignment_active and squared_distance < align_squared:
+                xvel_avg += velocities[other, 0]
+                yvel_avg += velocities[other, 1]
+                neighboring_boids_align += 1
+            if cohesion_active and squared_distance < cohesion_squared:
+                xpos_avg += other_x
+                ypos_avg += other_y
+                neighboring_boids_cohesion += 1
+    return combine_rules(boid_x, boid_y, velocities[index, 0], velocities[index, 1], parameters,
+                         separation_active, alignment_active, cohesion_active,
+                         close_dx, close_dy, xvel_avg, yvel_avg, neighboring_boids_align,
+                         xpos_avg, ypos_avg, neighboring_boids_cohesion)
+
+
+@nb.njit(nogil=True, cache=True)
+def update_boid_velocity_verlet_numba(positions, velocities, neighbor_start, neighbor_boids, parameters,
+                                      boid_velocities):
+    separation_active, alignment_active, cohesion_active = SEPARATION_ACTIVE, ALIGNMENT_ACTIVE, COHESION_ACTIVE
+    flock_length = positions.shape[0]
+    for index in nb.prange(flock_length):
+        boid_vx, boid_vy = steer_boid_verlet(index, positions, velocities, neighbor_start, neighbor_boids,
+                                             parameters, separation_active, alignment_active, cohesion_active)
+        boid_velocities[index, 0] = boid_vx
+        boid_velocities[index, 1] = boid_vy
+
+
+@nb.njit(nogil=True, cache=True)
+def step_flock_verlet_numba(positions, velocities, neighbor_start, neighbor_boids, parameters,
+                            boid_indices, next_positions, next_velocities, angles, speeds):
+    # the fused step of step_flock_grid_numba with the neighbors read from a Verlet list
+    separation_active, alignment_active, cohesion_active = SEPARATION_ACTIVE, ALIGNMENT_ACTIVE, COHESION_ACTIVE
+    for output in nb.prange(boid_indices.shape[0]):
+        index = boid_indices[output]
+        boid_vx, boid_vy = steer_boid_verlet(index, positions, velocities, neighbor_start, neighbor_boids,
+                                             parameters, separation_active, alignment_active, cohesion_active)
+        integrate_boid(index, output, boid_vx, boid_vy, positions, parameters,
+                       next_positions, next_velocities, angles, speeds)
+
+
+@nb.njit(inline='always')
+def integrate_boid(index, output, boid_vx, boid_vy, positions, parameters,
+                   next_positions, next_velocities, angles, speeds):
+    record = parameters[0]
+    speed_min, speed_max, dt = record['speed_min'], record['speed_max'], record['dt']
+    angles[output] = np.arctan2(-boid_vx, boid_vy) + np.pi / 2
+    speed = np.sqrt(boid_vx ** 2 + boid_vy ** 2)
+    if speed >= speed_max:
+        boid_vx, boid_vy = boid_vx * speed_max / speed, boid_vy * speed_max / speed
+        speed = speed_max
+    elif speed < speed_min:
+        if speed > 0:
+            boid_vx, boid_vy = boid_vx * speed_min / speed, boid_vy * speed_min / speed
+        speed = speed_min
+    speeds[output] = speed
+    next_velocities[output, 0] = boid_vx
+    next_velocities[output, 1] = boid_vy
+    boid_x = positions[index, 0] + boid_vx * dt
+    boid_y = positions[index, 1] + boid_vy * dt
+    if record['check_boundaries']:
+        boid_x = apply_boundary(boid_x, record['width'], record['horizontal_cyclic_boundary'])
+        boid_y = apply_boundary(boid_y, record['height'], record['vertical_cyclic_boundary'])
+    next_positions[output, 0] = boid_x
+    next_positions[output, 1] = boid_y
+
+
+@nb.njit(nogil=True, cache=True)
+def get_morton_codes(positions, width, height):
+    # 16 bits of each coordinate interleaved, boids close in space get close codes
+    codes = np.empty(positions.shape[0], dtype=np.int64)
+    for index in range(positions.shape[0]):
+        x = min(max(int(positions[index, 0] * 65535 / width), 0), 65535)
+        y = min(max(int(positions[index, 1] * 65535 / height), 0), 65535)
+        codes[index] = spread_bits(x) | (spread_bits(y) << 1)
+    return codes
+
+
+@nb.njit(inline='always')
+def spread_bits(value):
+    value = (value | (value << 8)) & 0x00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F
+    value = (value | (value << 2)) & 0x33333333
+    value = (value | (value << 1)) & 0x55555555
+    return value
+
+
+@nb.njit(inline='always')
+def apply_boundary(coordinate, limit, cyclic):
+    if coordinate >= limit:
+        return 0.0 if cyclic else float(limit)
+    if coordinate <= 0:
+        return float(limit) if cyclic else 0.0
+    return coordinate
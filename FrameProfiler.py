@@ -0,0 +1,49 @@
+import numpy as np
+from time import perf_counter
+
+
+class FrameProfiler:
+    def __init__(self, phases: tuple[str, ...], capacity: int = 1024):
+        self.phases = tuple(phases)
+        self.phase_index = {phase: index for index, phase in enumerate(self.phases)}
+        # one row of phase times per frame, the oldest frame is overwritten once the buffer is full
+        self.timings = np.zeros((capacity, len(self.phases)), dtype=np.float64)
+        self.capacity = capacity
+        self.frames = 0
+        self.frame_timings = np.zeros(len(self.phases), dtype=np.float64)
+        self.last_mark = perf_counter()
+
+    def begin_frame(self):
+        self.frame_timings[:] = 0
+        self.last_mark = perf_counter()
+
+    def mark(self, phase: str):
+        # the time since the previous mark is charged to the phase that just ended
+        now = perf_counter()
+        self.frame_timings[self.phase_index[phase]] += now - self.last_mark
+        self.last_mark = now
+
+    def end_frame(self):
+        self.timings[self.frames % self.capacity] = self.frame_timings
+        self.frames += 1
+
+    def get_timings(self):
+        # frames in the order they were recorded, the profiled thread may be writing one row meanwhile
+        if self.frames <= self.capacity:
+            return self.timings[:self.frames].copy()
+        return np.roll(self.timings, -(self.frames % self.capacity), axis=0)
+
+    def get_percentiles(self, percentiles: tuple[float, ...] = (50, 95, 99)):
+        timings = self.get_timings()
+        if timings.shape[0] == 0:
+            return np.zeros((len(percentiles), len(self.phases) + 1))
+        timings = np.column_stack((timings, timings.sum(axis=1)))
+        return np.percentile(timings, percentiles, axis=0)
+
+    def export_csv(self, path: str):
+        timings = self.get_timings()
+        first_frame = self.frames - timings.shape[0]
+        frames = np.arange(first_frame, self.frames)
+        rows = np.column_stack((frames, timings, timings.sum(axis=1)))
+        np.savetxt(path, rows, delimiter=',', header=','.join(('frame',) + self.phases + ('total',)),
+                   comments='', fmt=['%d'] + ['%.9f'] * (len(self.phases) + 1))
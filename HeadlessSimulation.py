@@ -0,0 +1,121 @@
+import argparse
+import numpy as np
+from time import perf_counter
+from Flock import Flock
+from FrameProfiler import FrameProfiler
+from TrajectoryRecorder import TrajectoryRecorder
+
+
+def parse_arguments(arguments: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Run the boid flocking simulation without a display.')
+    parser.add_argument('-n', '--boids', type=int, default=1300, help='number of boids')
+    parser.add_argument('-s', '--steps', type=int, default=1000, help='number of simulation steps')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the initial flock')
+    parser.add_argument('-b', '--backend', choices=Flock.get_available_backends(), default=None,
+                        help='velocity update backend, grid if numba is available and numpy otherwise')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=int, default=30, help='simulated frames per second, sets the time step')
+    parser.add_argument('--threads', type=int, default=None, help='numba thread count')
+    parser.add_argument('--fastmath', action='store_true', help='compile numba kernels with fastmath')
+    parser.add_argument('--verlet-skin', type=float, default=None,
+                        help='distance added to the largest active rule range by the neighbor lists of the verlet '
+                             'backend, derived from the top speed and time step when unset')
+    parser.add_argument('--precision', choices=('float64', 'float32'), default='float64',
+                        help='dtype of the flock state, float32 halves the memory the kernels read')
+    parser.add_argument('--record', default=None, help='trajectory file that every step is recorded to')
+    parser.add_argument('--record-dtype', choices=('float64', 'float32'), default='float64',
+                        help='precision of the recorded positions and velocities')
+    parser.add_argument('--profile', default=None, help='csv file for the time of every phase of every step')
+    rules = parser.add_argument_group('rules')
+    rules.add_argument('--check-boundaries', action=argparse.BooleanOptionalAction, default=True)
+    rules.add_argument('--horizontal-cyclic', action=argparse.BooleanOptionalAction, default=False)
+    rules.add_argument('--vertical-cyclic', action=argparse.BooleanOptionalAction, default=True)
+    rules.add_argument('--separation', action=argparse.BooleanOptionalAction, default=True)
+    rules.add_argument('--alignment', action=argparse.BooleanOptionalAction, default=False)
+    rules.add_argument('--cohesion', action=argparse.BooleanOptionalAction, default=True)
+    rules.add_argument('--horizontal-wall', action=argparse.BooleanOptionalAction, default=True)
+    rules.add_argument('--vertical-wall', action=argparse.BooleanOptionalAction, default=True)
+    return parser.parse_args(arguments)
+
+
+def run(arguments: argparse.Namespace):
+    np.random.seed(arguments.seed)
+    dt = 1 / arguments.fps
+    flock = Flock(arguments.boids, None,
+                  space_coordinates=(arguments.width, arguments.height),
+                  boid_size=2,
+                  speed_scale=200,
+                  speed_range=(1, 2),
+                  speed_active=True,
+                  avoid_range=15,
+                  avoid_factor=2,
+                  align_range=100,
+                  align_factor=0.08,
+                  cohesion_range=50,
+                  cohesion_factor=0.005,
+                  turn_margin=80,
+                  turn_factor=20,
+                  threads=arguments.threads,
+                  fastmath=arguments.fastmath,
+                  backend=arguments.backend,
+                  verlet_skin=arguments.verlet_skin,
+                  dtype=np.dtype(arguments.precision))
+    rules = dict(check_boundaries=arguments.check_boundaries,
+                 horizontal_cyclic_boundary=arguments.horizontal_cyclic,
+                 vertical_cyclic_boundary=arguments.vertical_cyclic,
+                 separation_active=arguments.separation,
+                 alignment_active=arguments.alignment,
+                 cohesion_active=arguments.cohesion,
+                 vertical_wall_active=arguments.vertical_wall,
+                 horizontal_wall_active=arguments.horizontal_wall)
+
+    compile_time = flock.warm_up(rules)
+    if arguments.record is not None:
+        flock.set_recorder(TrajectoryRecorder(arguments.record, flock, seed=arguments.seed, dt=dt, rules=rules,
+                                              dtype=np.dtype(arguments.record_dtype),
+                                              reserve_frames=arguments.steps))
+    # the first step is timed on its own, it includes any compilation the warm up did not cover
+    start = perf_counter()
+    flock.step(dt, **rules)
+    first_step_time = perf_counter() - start
+
+    profiler = None
+    if arguments.profile is not None:
+        profiler = FrameProfiler(Flock.phases, capacity=max(arguments.steps - 1, 1))
+        flock.set_profiler(profiler)
+    start = perf_counter()
+    for _ in range(arguments.steps - 1):
+        if profiler is not None:
+            profiler.begin_frame()
+        flock.step(dt, **rules)
+        if profiler is not None:
+            profiler.end_frame()
+    elapsed = perf_counter() - start
+    steps_per_second = (arguments.steps - 1) / elapsed if elapsed > 0 else float('inf')
+    print(f'backend {flock.backend}, boids {arguments.boids}, steps {arguments.steps}')
+    print(f'compile time: {compile_time:.6} s')
+    print(f'first step: {first_step_time:.6} s')
+    print(f'steps per second: {steps_per_second:.2f}')
+    print(f'recompilations after warm up: {flock.recompilations}')
+    if flock.backend == 'verlet':
+        neighbor_list = flock.get_neighbor_list_stats()
+        print(f"neighbor list: {neighbor_list['builds']} builds in {neighbor_list['frames']} steps, "
+              f"{neighbor_list['pairs']} pairs, {neighbor_list['memory'] / 2 ** 20:.1f} MB")
+    if profiler is not None:
+        profiler.export_csv(arguments.profile)
+        for phase, (p50, p95, p99) in zip(profiler.phases + ('total',), profiler.get_percentiles().T * 1000):
+            print(f'{phase:>12}: p50 {p50:.3f} ms, p95 {p95:.3f} ms, p99 {p99:.3f} ms')
+        flock.set_profiler(None)
+    if flock.recorder is not None:
+        print(f'recorded {flock.recorder.close()} frames to {arguments.record}')
+        flock.set_recorder(None)
+    return flock
+
+
+def main(arguments: list[str] | None = None):
+    run(parse_arguments(arguments))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import queue
+import threading
+import numpy as np
+from contextlib import contextmanager
+from time import perf_counter, sleep
+from Flock import Flock
+from FrameProfiler import FrameProfiler
+from FlockCore import NUMBA_AVAILABLE, nb
+
+
+class FlockSnapshot:
+    def __init__(self, number_of_boids: int, color: np.ndarray, dtype: type = np.float64):
+        self.number_of_boids = number_of_boids
+        # the precision of the flock, so publishing a frame is a plain copy without a conversion
+        self.position = np.zeros((number_of_boids, 2), dtype=dtype)
+        self.velocity = np.zeros((number_of_boids, 2), dtype=dtype)
+        self.angle = np.zeros(number_of_boids, dtype=dtype)
+        # colors are copied as well, they move with their boids when the flock is reordered
+        self.color = color.copy()
+        self.frame = 0
+
+    def copy_from(self, flock: Flock, frame: int):
+        np.copyto(self.position, flock.state.position)
+        np.copyto(self.velocity, flock.state.velocity)
+        np.copyto(self.angle, flock.state.angle)
+        np.copyto(self.color, flock.state.color)
+        self.frame = frame
+
+
+@nb.njit(parallel=True, cache=True)
+def start_threading_layer(values):
+    for index in nb.prange(values.shape[0]):
+        values[index] += 1
+
+
+class SimulationThread(threading.Thread):
+    # user interface fields that switch the rules of a step, the other fields are flock parameters
+    rule_fields = {
+        'avoid_active': 'separation_active',
+        'align_active': 'alignment_active',
+        'cohesion_active': 'cohesion_active',
+        'boundary_active': 'check_boundaries',
+        'cyclic_horizontal': 'horizontal_cyclic_boundary',
+        'cyclic_vertical': 'vertical_cyclic_boundary',
+        'wall_horizontal': 'horizontal_wall_active',
+        'wall_vertical': 'vertical_wall_active',
+    }
+
+    def __init__(self, flock: Flock, dt: float, rules: dict[str, bool], realtime: bool = True):
+        super().__init__(name='simulation', daemon=True)
+        self.flock = flock
+        self.dt = dt
+        self.rules = dict(rules)
+        self.realtime = realtime
+        # commands are only read by the simulation thread, SimpleQueue needs no lock on the render side
+        self.commands = queue.SimpleQueue()
+        self.snapshots = [FlockSnapshot(flock.number_of_boids, flock.state.color, flock.dtype) for _ in range(2)]
+        self.front = 0
+        self.swap_lock = threading.Lock()
+        self.running = threading.Event()
+        self.frame = 0
+        self.frame_time = 0
+        self.warm_up_time = None
+        self.profiler = FrameProfiler(('commands',) + Flock.phases + ('publish',))
+        flock.set_profiler(self.profiler)
+        self.snapshots[self.front].copy_from(flock, self.frame)
+        if NUMBA_AVAILABLE and flock.parallel:
+            # the tbb threading layer hangs at exit if its first parallel launch is not made from the main thread
+            start_threading_layer(np.zeros(flock.threads))
+
+    def send(self, command, *args):
+        self.commands.put((command, args))
+
+    def set_rule(self, name: str, value: bool):
+        self.rules[name] = value
+
+    def set_parameters(self, changes: dict):
+        for field, rule in self.rule_fields.items():
+            if field in changes:
+                self.rules[rule] = changes[field]
+        self.flock.set_parameters(changes)
+
+    @contextmanager
+    def front_snapshot(self):
+        # the back buffer is never swapped in while the renderer reads the front one
+        with self.swap_lock:
+            yield self.snapshots[self.front]
+
+    def publish(self):
+        back = 1 - self.front
+        self.snapshots[back].copy_from(self.flock, self.frame)
+        with self.swap_lock:
+            self.front = back
+
+    def run_commands(self):
+        while True:
+            try:
+                command, args = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            command(*args)
+
+    def run(self):
+        self.running.set()
+        # the kernels of the current rules are compiled here, while the render loop and the user interface keep
+        # running, the variants of the other pair rules are compiled in the background once stepping has started
+        self.warm_up_time = self.flock.warm_up(self.rules)
+        print(f'kernel warm up: {self.warm_up_time:.3f} s')
+        threading.Thread(target=self.flock.warm_up_variants, args=(dict(self.rules),), name='kernel warm up',
+                         daemon=True).start()
+        while self.running.is_set():
+            start = perf_counter()
+            self.profiler.begin_frame()
+            self.run_commands()
+            self.profiler.mark('commands')
+            if self.flock.speed_active:
+                self.flock.step(self.dt, **self.rules)
+                self.frame += 1
+            self.frame_time = perf_counter() - start
+            self.publish()
+            self.profiler.mark('publish')
+            self.profiler.end_frame()
+            if self.realtime:
+                sleep(max(self.dt - (perf_counter() - start), 0))
+
+    def stop(self, timeout: float | None = None):
+        self.running.clear()
+        self.join(timeout)
@@ -0,0 +1,93 @@
+import os
+import numpy as np
+from TrajectoryRecorder import HEADER_SIZE, read_trajectory
+
+
+class ReplayFrame:
+    # the renderer reads the same fields as from a FlockSnapshot, position and velocity are views of the file
+    def __init__(self, number_of_boids: int, color: np.ndarray):
+        self.number_of_boids = number_of_boids
+        self.position = None
+        self.velocity = None
+        self.angle = np.zeros(number_of_boids, dtype=np.float64)
+        self.color = color
+        self.frame = None
+
+
+class TrajectoryPlayer:
+    speeds = (0.25, 0.5, 1, 2, 5, 10, 20)
+
+    def __init__(self, path: str, prefetch_frames: int = 30):
+        self.header, self.frames = read_trajectory(path)
+        if self.header['frames'] == 0:
+            raise ValueError(f'{path} holds no frames')
+        self.number_of_frames = self.header['frames']
+        self.frame_size = self.frames[0].nbytes
+        self.dt = self.header['dt'] or 1 / 30
+        self.cursor = 0.0
+        self.speed = 1
+        self.playing = True
+        self.prefetch_frames = prefetch_frames
+        self.file = open(path, 'rb')
+        color = np.zeros((self.header['boids'], 4), dtype=np.uint8)
+        color[:] = (0, 150, 255, 255)
+        self.replay_frame = ReplayFrame(self.header['boids'], color)
+
+    def get_boid_scale(self):
+        return self.header['parameters']['boid_scale']
+
+    def toggle(self):
+        self.playing = not self.playing
+        # a paused player at the last frame starts over
+        if self.playing and int(self.cursor) == self.number_of_frames - 1:
+            self.seek(0)
+
+    def change_speed(self, steps: int):
+        index = min(max(self.speeds.index(self.speed) + steps, 0), len(self.speeds) - 1)
+        self.speed = self.speeds[index]
+
+    def seek(self, frame: float):
+        # frames sit at fixed offsets of the mapped file, so any frame is reached without reading the others
+        self.cursor = float(min(max(frame, 0), self.number_of_frames - 1))
+        self.prefetch(int(self.cursor), self.prefetch_frames)
+
+    def seek_time(self, seconds: float):
+        self.seek(self.cursor + seconds / self.dt)
+
+    def advance(self):
+        if not self.playing:
+            return
+        self.cursor += self.speed
+        if self.cursor >= self.number_of_frames - 1:
+            self.cursor = float(self.number_of_frames - 1)
+            self.playing = False
+
+    def prefetch(self, frame: int, count: int = 1):
+        # asks the kernel to read the frames shown next into the page cache, at high speeds the skipped
+        # frames are never read, without posix_fadvise the plain readahead of the system is used
+        if not hasattr(os, 'posix_fadvise'):
+            return
+        step = max(int(self.speed), 1)
+        for ahead in range(count):
+            prefetched = frame + ahead * step
+            if prefetched >= self.number_of_frames:
+                return
+            os.posix_fadvise(self.file.fileno(), HEADER_SIZE + prefetched * self.frame_size, self.frame_size,
+                             os.POSIX_FADV_WILLNEED)
+
+    def get_frame(self):
+        frame = int(self.cursor)
+        if frame != self.replay_frame.frame:
+            replay_frame = self.replay_frame
+            replay_frame.position, replay_frame.velocity = self.frames[frame, 0], self.frames[frame, 1]
+            np.arctan2(-replay_frame.velocity[:, 0], replay_frame.velocity[:, 1], out=replay_frame.angle)
+            replay_frame.angle += np.pi / 2
+            replay_frame.frame = frame
+            # one new frame at the end of the prefetch window per shown frame
+            self.prefetch(frame + self.prefetch_frames * max(int(self.speed), 1))
+        return self.replay_frame
+
+    def close(self):
+        self.replay_frame.position = self.replay_frame.velocity = None
+        self.frames = None
+        self.file.close()
@@ -0,0 +1,140 @@
+import json
+import queue
+import threading
+import numpy as np
+from Flock import Flock
+
+
+MAGIC = b'BOIDTRAJ'
+HEADER_SIZE = 4096
+# flock fields stored in the header, everything needed to rerun or label a recording
+HEADER_PARAMETERS = ('boid_scale', 'speed_min', 'speed_max', 'avoid_range', 'avoid_factor', 'align_range',
+                     'align_factor', 'cohesion_range', 'cohesion_factor', 'turn_margin', 'turn_factor')
+
+
+def write_header(file, header: dict):
+    data = json.dumps(header).encode()
+    if len(MAGIC) + 8 + len(data) > HEADER_SIZE:
+        raise ValueError(f'trajectory header is larger than {HEADER_SIZE} bytes')
+    file.seek(0)
+    file.write(MAGIC + np.uint64(len(data)).tobytes() + data.ljust(HEADER_SIZE - len(MAGIC) - 8, b' '))
+    file.flush()
+
+
+def read_header(path: str):
+    with open(path, 'rb') as file:
+        data = file.read(HEADER_SIZE)
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} is not a boid trajectory file')
+    length = int(np.frombuffer(data, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+    return json.loads(data[len(MAGIC) + 8:len(MAGIC) + 8 + length])
+
+
+def read_trajectory(path: str):
+    # frames[f, 0] are the positions and frames[f, 1] the velocities of frame f, mapped and not loaded
+    header = read_header(path)
+    frames = np.memmap(path, dtype=header['dtype'], mode='r', offset=HEADER_SIZE,
+                       shape=(header['frames'], 2, header['boids'], 2))
+    return header, frames
+
+
+class TrajectoryRecorder:
+    def __init__(self, path: str, flock: Flock,
+                 seed: int | None = None,
+                 dt: float | None = None,
+                 rules: dict[str, bool] | None = None,
+                 dtype: type = np.float64,
+                 reserve_frames: int = 0,
+                 chunk_memory: int = 32 * 2 ** 20,
+                 buffers: int = 3):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.frame_shape = (2, flock.number_of_boids, 2)
+        self.frame_size = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.chunk_frames = max(chunk_memory // max(self.frame_size, 1), 1)
+        self.header = {
+            'boids': flock.number_of_boids,
+            'dtype': self.dtype.name,
+            'width': flock.WIDTH,
+            'height': flock.HEIGHT,
+            'dt': dt,
+            'seed': seed,
+            'backend': flock.backend,
+            'precision': flock.dtype.name,
+            'rules': dict(rules) if rules is not None else None,
+            'parameters': {name: float(getattr(flock, name)) for name in HEADER_PARAMETERS},
+            'frames': 0,
+        }
+        self.file = open(path, 'w+b')
+        write_header(self.file, self.header)
+        self.frames = None
+        self.capacity = 0
+        self.written_frames = 0
+        self.reserve(max(reserve_frames, self.chunk_frames))
+
+        # the simulation fills one chunk in memory while the writer copies full chunks into the mapped file,
+        # once every buffer waits for the writer the simulation blocks instead of queueing without bound
+        self.free_buffers = queue.SimpleQueue()
+        for _ in range(buffers):
+            self.free_buffers.put(np.empty((self.chunk_frames,) + self.frame_shape, dtype=self.dtype))
+        self.full_buffers = queue.SimpleQueue()
+        self.buffer = self.free_buffers.get()
+        self.buffer_frames = 0
+        self.writer = threading.Thread(target=self.write_chunks, name='trajectory writer', daemon=True)
+        self.writer.start()
+
+    def reserve(self, frames: int):
+        # the file grows geometrically, so remapping stays rare however long the recording is
+        if frames <= self.capacity:
+            return
+        capacity = max(frames, 2 * self.capacity)
+        if self.frames is not None:
+            self.frames.flush()
+            self.frames = None
+        self.file.truncate(HEADER_SIZE + capacity * self.frame_size)
+        self.frames = np.memmap(self.file, dtype=self.dtype, mode='r+', offset=HEADER_SIZE,
+                                shape=(capacity,) + self.frame_shape)
+        self.capacity = capacity
+
+    def record(self, positions: np.ndarray, velocities: np.ndarray, boid_ids: np.ndarray | None = None):
+        # row i of a reordered flock is written to the row of boid boid_ids[i], so every boid keeps its row
+        # in the recording however often the flock is reordered
+        if boid_ids is None:
+            self.buffer[self.buffer_frames, 0] = positions
+            self.buffer[self.buffer_frames, 1] = velocities
+        else:
+            self.buffer[self.buffer_frames, 0, boid_ids] = positions
+            self.buffer[self.buffer_frames, 1, boid_ids] = velocities
+        self.buffer_frames += 1
+        if self.buffer_frames == self.chunk_frames:
+            self.submit()
+
+    def submit(self):
+        self.full_buffers.put((self.buffer, self.buffer_frames))
+        self.buffer = self.free_buffers.get()
+        self.buffer_frames = 0
+
+    def write_chunks(self):
+        while True:
+            chunk = self.full_buffers.get()
+            if chunk is None:
+                return
+            buffer, frames = chunk
+            self.reserve(self.written_frames + frames)
+            self.frames[self.written_frames:self.written_frames + frames] = buffer[:frames]
+            self.written_frames += frames
+            self.free_buffers.put(buffer)
+            # the header always counts the frames on disk, a recording cut short is still readable
+            self.header['frames'] = self.written_frames
+            write_header(self.file, self.header)
+
+    def close(self):
+        if self.buffer_frames:
+            self.full_buffers.put((self.buffer, self.buffer_frames))
+        self.full_buffers.put(None)
+        self.writer.join()
+        self.frames.flush()
+        self.frames = None
+        self.file.truncate(HEADER_SIZE + self.written_frames * self.frame_size)
+        self.file.close()
+        return self.written_frames
@@ -59,6 +59,9 @@ class UserInterface:
         self.main_box = None
 
         self.parameters = BoidFlockingParameters()
+        # widgets by parameter field, and the fields changed since the simulation last took them
+        self.widgets = {}
+        self.changes = {}
 
         self.create_row_boid()
         self.create_row_speed()
@@ -74,55 +77,56 @@ class UserInterface:
 
     def create_row_boid(self):
         self.row_boid = tp.SliderWithText('Boid size', 1, 10, self.parameters.boid, 100)
+        self.bind('boid', self.row_boid)
         # print(self.row_boid.get_value())
 
     def create_row_speed(self):
         speed_active = tp.SwitchButton(False)
-        speed_active.at_unclick = self.parameter_changed
+        self.bind('speed_active', speed_active)
         speed_range = tp.SliderWithText('scale', 1, 10, self.parameters.speed_range, 40)
-        speed_range.at_unclick = self.parameter_changed
+        self.bind('speed_range', speed_range)
         speed_scale = tp.SliderWithText('range', 100, 500, self.parameters.speed_scale, 40)
-        speed_scale.at_unclick = self.parameter_changed
+        self.bind('speed_scale', speed_scale)
         self.row_speed = tp.Group([speed_active, speed_range, speed_scale], 'h')
         self.box_speed = tp.TitleBox('Speed', children=[self.row_speed])
 
     def create_row_avoid(self):
         avoid_active = tp.SwitchButtonWithText('active', texts=('', ''), value=self.parameters.avoid_active)
-        avoid_active.at_unclick = self.parameter_changed
+        self.bind('avoid_active', avoid_active)
         avoid_range = tp.SliderWithText('range', 10, 200, self.parameters.avoid_range, 40)
-        avoid_range.at_unclick = self.parameter_changed
+        self.bind('avoid_range', avoid_range)
         avoid_factor = tp.SliderWithText('factor', 0, 2, self.parameters.avoid_factor, 40)
-        avoid_factor.at_unclick = self.parameter_changed
+        self.bind('avoid_factor', avoid_factor)
         self.row_avoid = tp.Group([avoid_active, avoid_range, avoid_factor], 'h')
         self.box_avoid = tp.TitleBox('Avoidance', children=[self.row_avoid])
 
     def create_row_align(self):
         align_active = tp.SwitchButtonWithText('active', texts=('', ''), value=self.parameters.align_active)
-        align_active.at_unclick = self.parameter_changed
+        self.bind('align_active', align_active)
         align_range = tp.SliderWithText('range', 10, 500, self.parameters.align_range, 40)
-        align_range.at_unclick = self.parameter_changed
+        self.bind('align_range', align_range)
         align_factor = tp.SliderWithText('factor', 0, 2, self.parameters.align_factor, 40)
-        align_factor.at_unclick = self.parameter_changed
+        self.bind('align_factor', align_factor)
         self.row_align = tp.Group([align_active, align_range, align_factor], 'h')
         self.box_align = tp.TitleBox('Alignment', children=[self.row_align])
 
     def create_row_cohesion(self):
         cohesion_active = tp.SwitchButtonWithText('active', texts=('', ''), value=self.parameters.cohesion_active)
-        cohesion_active.at_unclick = self.parameter_changed
+        self.bind('cohesion_active', cohesion_active)
         cohesion_range = tp.SliderWithText('range', 10, 500, self.parameters.cohesion_range, 40)
-        cohesion_range.at_unclick = self.parameter_changed
+        self.bind('cohesion_range', cohesion_range)
         cohesion_factor = tp.SliderWithText('factor', 0, 2, self.parameters.cohesion_active, 40)
-        cohesion_factor.at_unclick = self.parameter_changed
+        self.bind('cohesion_factor', cohesion_factor)
         self.row_cohesion = tp.Group([cohesion_active, cohesion_range, cohesion_factor], 'h')
         self.box_cohesion = tp.TitleBox('Cohesion', children=[self.row_cohesion])
 
     def create_row_boundary(self):
         boundary_active = tp.SwitchButtonWithText('active', texts=('', ''), value=self.parameters.boundary_active)
-        boundary_active.at_unclick = self.parameter_changed
+        self.bind('boundary_active', boundary_active)
         boundary_margin = tp.SliderWithText('margin', 10, 500, self.parameters.boundary_margin, 40)
-        boundary_margin.at_unclick = self.parameter_changed
+        self.bind('boundary_margin', boundary_margin)
         boundary_factor = tp.SliderWithText('factor', 2, 100, self.parameters.boundary_factor, 40)
-        boundary_factor.at_unclick = self.parameter_changed
+        self.bind('boundary_factor', boundary_factor)
         self.row_boundary = tp.Group([boundary_active, boundary_margin, boundary_factor], 'h')
         self.create_row_cyclic()
         self.create_row_wall()
@@ -131,20 +135,20 @@ class UserInterface:
     def create_row_cyclic(self):
         cyclic_horizontal = tp.SwitchButtonWithText('Horizontal', texts=('on', 'off'),
                                                     value=self.parameters.cyclic_horizontal)
-        cyclic_horizontal.at_unclick = self.parameter_changed
+        self.bind('cyclic_horizontal', cyclic_horizontal)
         cyclic_vertical = tp.SwitchButtonWithText('Vertical', texts=('on', 'off'),
                                                   value=self.parameters.cyclic_vertical)
-        cyclic_vertical.at_unclick = self.parameter_changed
+        self.bind('cyclic_vertical', cyclic_vertical)
         self.row_cyclic = tp.Group([cyclic_horizontal, cyclic_vertical], 'h')
         self.box_cyclic = tp.TitleBox('Cyclic', children=[self.row_cyclic])
 
     def create_row_wall(self):
         wall_horizontal = tp.SwitchButtonWithText('Horizontal', texts=('on', 'off'),
                                                   value=self.parameters.wall_horizontal)
-        wall_horizontal.at_unclick = self.parameter_changed
+        self.bind('wall_horizontal', wall_horizontal)
         wall_vertical = tp.SwitchButtonWithText('Vertical', texts=('on', 'off'),
                                                 value=self.parameters.wall_vertical)
-        wall_vertical.at_click = self.parameter_changed
+        self.bind('wall_vertical', wall_vertical)
         self.row_wall = tp.Group([wall_horizontal, wall_vertical], 'h')
         self.box_wall = tp.TitleBox('Wall', children=[self.row_wall])
 
@@ -154,36 +158,23 @@ class UserInterface:
         self.main_box.set_topleft(self.WIDTH - self.main_box.rect.size[0] - self.margin, self.margin)
         # self.main_box.at_unclick = self.main_box_clicked
 
-    def parameter_changed(self):
-        speed_widgets = self.row_speed.get_children()
-        avoid_widgets = self.row_avoid.get_children()
-        align_widgets = self.row_align.get_children()
-        cohesion_widgets = self.row_cohesion.get_children()
-        boundary_widgets = self.row_boundary.get_children()
-        cyclic_widgets = self.row_cyclic.get_children()
-        wall_widgets = self.row_wall.get_children()
-        new_parameters = BoidFlockingParameters(boid=self.row_boid.get_value(),
-                                                speed_active=speed_widgets[0].get_value(),
-                                                speed_range=speed_widgets[1].get_value(),
-                                                speed_scale=speed_widgets[2].get_value(),
-                                                avoid_active=avoid_widgets[0].get_value(),
-                                                avoid_range=avoid_widgets[1].get_value(),
-                                                avoid_factor=avoid_widgets[2].get_value(),
-                                                align_active=align_widgets[0].get_value(),
-                                                align_range=align_widgets[1].get_value(),
-                                                align_factor=align_widgets[2].get_value(),
-                                                cohesion_active=cohesion_widgets[0].get_value(),
-                                                cohesion_range=cohesion_widgets[1].get_value(),
-                                                cohesion_factor=cohesion_widgets[2].get_value(),
-                                                boundary_active=boundary_widgets[0].get_value(),
-                                                boundary_margin=boundary_widgets[1].get_value(),
-                                                boundary_factor=boundary_widgets[2].get_value(),
-                                                cyclic_horizontal=cyclic_widgets[0].get_value(),
-                                                cyclic_vertical=cyclic_widgets[1].get_value(),
-                                                wall_horizontal=wall_widgets[0].get_value(),
-                                                wall_vertical=wall_widgets[1].get_value())
-        self.parameters = new_parameters
-        print(new_parameters)
+    def bind(self, field: str, widget):
+        self.widgets[field] = widget
+        widget.at_unclick = self.parameter_changed
+        widget.at_unclick_params = {'field': field}
+
+    def parameter_changed(self, field: str):
+        # only the field of the released widget is read, unchanged values are not passed on
+        widget = self.widgets[field]
+        # switches with text return their label from get_value, the state is on the switch itself
+        value = widget.switch.value if isinstance(widget, tp.SwitchButtonWithText) else widget.get_value()
+        if value != getattr(self.parameters, field):
+            setattr(self.parameters, field, value)
+            self.changes[field] = value
+
+    def pop_changes(self):
+        changes, self.changes = self.changes, {}
+        return changes
 
     def create_updater(self):
         self.updater = self.main_box.get_updater()